@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import sys
+
+import tensorflow as tf
+
+import train
+
+
+def get_run_argv(run: dict) -> list:
+    """train.py flags of a run given as {flag: value}, true booleans become bare flags and false ones are left out"""
+    argv = []
+    for name, value in run.items():
+        if isinstance(value, bool):
+            if value:
+                argv.append(f'--{name}')
+        else:
+            argv += [f'--{name}', str(value)]
+    return argv
+
+
+def train_runs(run_argvs: list, threads=0, evaluate=False) -> list:
+    """Trains every run in one graph and one session, interleaving their steps
+
+    Each run builds its networks in a variable scope of its own and keeps its own environments, replay buffer
+    and exploration schedule, so it trains as it would alone. Runs on the same portfolio share its dataset
+    and state table. Models are saved as train.py saves them, and with evaluate every run is evaluated at the
+    end of training as train.py --load would. Returns the TrainingRun of every run.
+    """
+    datasets = {}
+    state_tables = {}
+    runs = [train.TrainingRun(argv, datasets, state_tables) for argv in run_argvs]
+    for run in runs:
+        if run.args.load:
+            raise ValueError('--load is not supported in batch training, evaluate with train.py --load instead')
+        if run.args.tf2:
+            raise ValueError('--tf2 runs train eagerly, train them with train.py instead')
+
+    with tf.Graph().as_default():
+        for k, run in enumerate(runs):
+            run.build(scope=f'run{k}')
+        with tf.compat.v1.Session(config=train.get_session_config(threads)) as sess:
+            sess.run(tf.compat.v1.global_variables_initializer())
+            episodes = [0] * len(runs)
+            active = []
+            for k, run in enumerate(runs):
+                run.trainer.initialize(sess)
+                if run.args.num_episodes > 0:
+                    run.log_episode_start(0)
+                    run.trainer.start_episode()
+                    active.append(k)
+
+            # One step of every unfinished run in turn, each run starting its next episode as soon as one ends
+            while active:
+                for k in list(active):
+                    run = runs[k]
+                    if not run.trainer.step(sess):
+                        continue
+                    nav, ep_reward = run.trainer.end_episode()
+                    print(f'{run.path} episode {episodes[k]}:')
+                    run.end_episode(sess, episodes[k], nav, ep_reward)
+                    episodes[k] += 1
+                    if episodes[k] == run.args.num_episodes:
+                        active.remove(k)
+                    else:
+                        run.log_episode_start(episodes[k])
+                        run.trainer.start_episode()
+
+            if evaluate:
+                for run in runs:
+                    print(f'Evaluating {run.path}')
+                    run.evaluate(sess)
+    return runs
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--runs", required=True,
+                            help='JSON file or inline JSON of a list of runs, each {train.py flag: value}, e.g. '
+                                 '[{"choose_set_num": 0, "stocks": "AUD,CAD,USD", "path": "data/rl/portfolio1/lagged"}]')
+    arg_parser.add_argument("--threads", type=int, default=0, help='Intra and inter op threads of the session')
+    arg_parser.add_argument("--evaluate", action='store_true', help='Write the NAV files of every run after training')
+    args = arg_parser.parse_args(argv)
+
+    if os.path.exists(args.runs):
+        with open(args.runs) as f:
+            runs = json.load(f)
+    else:
+        runs = json.loads(args.runs)
+    train_runs([get_run_argv(run) for run in runs], args.threads, args.evaluate)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,235 @@
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import util
+
+# Composer parameters with one gene per asset, as (low, high, is_integer)
+asset_params = {
+    'cvar_period': (2, 60, True),
+    'mc_period': (2, 60, True),
+    'sp_period': (2, 60, True),
+    'c1': (-1., 1., False),
+    'c2': (-1., 1., False),
+}
+thres_bounds = (0., 0.5)
+
+# Dataset of a worker process, set up once by _init_worker
+_dataset = None
+
+
+def get_gene_bounds(num_assets: int) -> tuple:
+    """(low, high, is_integer) arrays over the genes, asset_params in order with one gene per asset, then thres"""
+    low, high, is_integer = [], [], []
+    for param_low, param_high, param_is_integer in asset_params.values():
+        low += [param_low] * num_assets
+        high += [param_high] * num_assets
+        is_integer += [param_is_integer] * num_assets
+    low.append(thres_bounds[0])
+    high.append(thres_bounds[1])
+    is_integer.append(False)
+    return np.array(low, dtype=float), np.array(high, dtype=float), np.array(is_integer)
+
+
+def decode(genes, num_assets: int) -> dict:
+    """Keyword parameters of cal_portfolio_comp_fitness held by a gene vector"""
+    params = {}
+    for k, (name, (_, _, is_integer)) in enumerate(asset_params.items()):
+        values = genes[k * num_assets:(k + 1) * num_assets]
+        params[name] = [int(round(v)) for v in values] if is_integer else [float(v) for v in values]
+    params['thres'] = float(genes[-1])
+    return params
+
+
+def share_dataset(df_list: list, date_range: list, trend_list: list) -> tuple:
+    """Copy the columns the composer reads into one shared memory block
+
+    Returns (shared memory, layout), layout lists (name, dtype, offset, length) of every array in the block.
+    """
+    arrays = []
+    for i, df in enumerate(df_list):
+        arrays += [(f'{i}/Date', df['Date'].values), (f'{i}/Close', df['Close'].values),
+                   (f'{i}/returns', df['returns'].values)]
+    arrays += [('date_range', pd.DatetimeIndex(date_range).values), ('trend_list', pd.DatetimeIndex(trend_list).values)]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(sum(array.nbytes for _, array in arrays), 1))
+    layout = []
+    offset = 0
+    for name, array in arrays:
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf, offset=offset)[:] = array
+        layout.append((name, array.dtype.str, offset, len(array)))
+        offset += array.nbytes
+    return shm, layout
+
+
+def _init_worker(shm_name: str, layout: list, num_assets: int, settings: dict):
+    """Rebuilds the dataset from shared memory once per worker process"""
+    global _dataset
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = {name: np.ndarray((length,), np.dtype(dtype), buffer=shm.buf, offset=offset)
+              for name, dtype, offset, length in layout}
+    df_list = [pd.DataFrame({'Date': arrays[f'{i}/Date'], 'Close': arrays[f'{i}/Close'],
+                             'returns': arrays[f'{i}/returns']}) for i in range(num_assets)]
+    date_range = pd.DatetimeIndex(arrays['date_range']).tolist()
+    trend_list = pd.DatetimeIndex(arrays['trend_list']).tolist()
+    # The frames hold copies, so the block can be released right away
+    shm.close()
+    _dataset = (df_list, date_range, trend_list, util.PricePanel(df_list, date_range), settings)
+
+
+def evaluate(genes) -> float:
+    """cal_fitness_with_nav fitness of the composer with the parameters of genes, in a worker process"""
+    df_list, date_range, trend_list, price_panel, settings = _dataset
+    params = decode(genes, len(df_list))
+    fitness = []
+    util.cal_portfolio_comp_fitness(list(settings['start_assets']), settings['base_rates'], settings['start_comp'],
+                                    df_list, date_range, trend_list, params['cvar_period'], params['mc_period'],
+                                    params['sp_period'], params['c1'], params['c2'], params['thres'], fitness,
+                                    price_panel=price_panel)
+    return fitness[-1]
+
+
+def random_population(rng: np.random.Generator, size: int, bounds: tuple) -> np.ndarray:
+    low, high, is_integer = bounds
+    population = rng.uniform(low, high, (size, len(low)))
+    population[:, is_integer] = np.round(population[:, is_integer])
+    return population
+
+
+def tournament_select(rng: np.random.Generator, fitness: np.ndarray, num_parents: int,
+                      tournament_size=3) -> np.ndarray:
+    """Rows of num_parents parents, each the fittest of tournament_size random individuals"""
+    entrants = rng.integers(0, len(fitness), (num_parents, tournament_size))
+    return entrants[np.arange(num_parents), np.argmax(fitness[entrants], axis=1)]
+
+
+def breed(rng: np.random.Generator, population: np.ndarray, fitness: np.ndarray, num_children: int, bounds: tuple,
+          tournament_size=3, crossover_rate=0.9, mutation_rate=0.1, mutation_scale=0.1) -> np.ndarray:
+    """Children by tournament selection, uniform crossover and gaussian mutation"""
+    low, high, is_integer = bounds
+    parents_a = population[tournament_select(rng, fitness, num_children, tournament_size)]
+    parents_b = population[tournament_select(rng, fitness, num_children, tournament_size)]
+    cross = (rng.random(parents_a.shape) < 0.5) & (rng.random((num_children, 1)) < crossover_rate)
+    children = np.where(cross, parents_b, parents_a)
+
+    mutate = rng.random(children.shape) < mutation_rate
+    children = children + mutate * rng.normal(0, mutation_scale * (high - low), children.shape)
+    children = np.clip(children, low, high)
+    children[:, is_integer] = np.round(children[:, is_integer])
+    return children
+
+
+def save_checkpoint(out_dir: str, generation: int, population: np.ndarray, fitness: np.ndarray,
+                    rng: np.random.Generator, num_assets: int):
+    """Writes generation_<n>.json with the population, its fitness, the generator state and the best parameters"""
+    best = int(np.argmax(fitness))
+    checkpoint = {'generation': generation, 'population': population.tolist(), 'fitness': fitness.tolist(),
+                  'rng_state': rng.bit_generator.state,
+                  'best': {**decode(population[best], num_assets), 'fitness': float(fitness[best])}}
+    # Written under a temporary name first, so an interrupted write never leaves a broken checkpoint
+    path = os.path.join(out_dir, f'generation_{generation:04d}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(out_dir: str):
+    """The latest generation checkpoint of out_dir, or None"""
+    paths = sorted(glob.glob(os.path.join(out_dir, 'generation_*.json')))
+    if not paths:
+        return None
+    with open(paths[-1]) as f:
+        return json.load(f)
+
+
+def run_ga(choose_set_num, out_dir: str, population_size=32, generations=20, elite=2, tournament_size=3,
+           crossover_rate=0.9, mutation_rate=0.1, workers=None, seed=None, base_rates=None,
+           start_comp=None, start_assets=None) -> dict:
+    """Tunes the composer parameters of one portfolio with a genetic algorithm
+
+    Every generation is evaluated across a process pool whose workers read the dataset from shared memory,
+    and checkpointed to out_dir, from where a rerun resumes. Returns the best parameters and their fitness.
+    """
+    df_list, date_range, trend_list = util.get_algo_dataset(choose_set_num)[:3]
+    num_assets = len(df_list)
+    if base_rates is None:
+        base_rates = [util.get_base_rate(num_assets)] * num_assets
+    settings = {'base_rates': list(base_rates),
+                'start_comp': list(start_comp) if start_comp is not None else [1 / num_assets] * num_assets,
+                'start_assets': list(start_assets) if start_assets is not None else [100000] * num_assets}
+    bounds = get_gene_bounds(num_assets)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    shm, layout = share_dataset(df_list, date_range, trend_list)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shm.name, layout, num_assets, settings)) as executor:
+            def evaluate_all(population):
+                chunksize = max(1, len(population) // (4 * (workers or os.cpu_count() or 1)))
+                return np.array(list(executor.map(evaluate, population.tolist(), chunksize=chunksize)))
+
+            checkpoint = load_checkpoint(out_dir)
+            if checkpoint is not None:
+                generation = checkpoint['generation']
+                population = np.array(checkpoint['population'])
+                fitness = np.array(checkpoint['fitness'])
+                rng = np.random.default_rng()
+                rng.bit_generator.state = checkpoint['rng_state']
+                print(f'Resuming from generation {generation}')
+            else:
+                generation = 0
+                rng = np.random.default_rng(seed)
+                population = random_population(rng, population_size, bounds)
+                fitness = evaluate_all(population)
+                save_checkpoint(out_dir, generation, population, fitness, rng, num_assets)
+
+            while generation < generations:
+                # Elites carry over with their known fitness, only the children are evaluated
+                elites = np.argsort(fitness)[::-1][:elite]
+                children = breed(rng, population, fitness, len(population) - len(elites), bounds, tournament_size,
+                                 crossover_rate, mutation_rate)
+                population = np.vstack([population[elites], children])
+                fitness = np.concatenate([fitness[elites], evaluate_all(children)])
+                generation += 1
+                save_checkpoint(out_dir, generation, population, fitness, rng, num_assets)
+                print(f'Generation {generation}: best fitness {fitness.max():.4f}, mean fitness {fitness.mean():.4f}')
+    finally:
+        shm.close()
+        shm.unlink()
+
+    best = int(np.argmax(fitness))
+    return {**decode(population[best], num_assets), 'fitness': float(fitness[best])}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--choose_set_num", required=True,
+                            help='Portfolio positions or names to tune one after the other, e.g. 0,1,2')
+    arg_parser.add_argument("--out", required=True, help='Directory that holds one subdirectory per portfolio')
+    arg_parser.add_argument("--population", type=int, default=32)
+    arg_parser.add_argument("--generations", type=int, default=20)
+    arg_parser.add_argument("--elite", type=int, default=2)
+    arg_parser.add_argument("--tournament_size", type=int, default=3)
+    arg_parser.add_argument("--crossover_rate", type=float, default=0.9)
+    arg_parser.add_argument("--mutation_rate", type=float, default=0.1)
+    arg_parser.add_argument("--base_rates", default=None, help='One per asset, util.get_base_rate by default')
+    arg_parser.add_argument("--workers", type=int, default=None)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    args = arg_parser.parse_args()
+
+    for choose_set_num in args.choose_set_num.split(','):
+        portfolio_name = util.get_portfolio(choose_set_num)['name']
+        out_dir = os.path.join(args.out, portfolio_name)
+        best = run_ga(choose_set_num, out_dir, args.population, args.generations, args.elite, args.tournament_size,
+                      args.crossover_rate, args.mutation_rate, args.workers, args.seed,
+                      [float(rate) for rate in args.base_rates.split(',')] if args.base_rates else None)
+        with open(os.path.join(out_dir, 'best.json'), 'w') as f:
+            json.dump(best, f, indent=2)
+        print(f'Best parameters of {portfolio_name}: {best}')
@@ -1 +1,2 @@
-from .technical_indicators import *
\ No newline at end of file
+from .technical_indicators import *
+from .streaming import *
\ No newline at end of file
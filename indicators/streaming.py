@@ -0,0 +1,54 @@
+import math
+
+class StreamingEMA():
+    """Exponential moving average updated one value at a time
+
+    Follows the arithmetic of pandas ewm(span=window_size).mean() (adjust=True, ignore_na=False), so after
+    every update the value equals the last row of exponential_moving_avg(df, window_size, center=False)
+    over all values seen so far.
+    """
+    def __init__(self, window_size=15):
+        self.window_size = window_size
+        self.old_wt_factor = 1. - 2. / (window_size + 1)
+        self.reset()
+
+    def reset(self):
+        self.weighted = math.nan
+        self.old_wt = 1.
+
+    def update(self, value: float) -> float:
+        is_observation = value == value
+        if self.weighted != self.weighted:
+            # No value seen yet, the first observation starts the average
+            if is_observation:
+                self.weighted = value
+        else:
+            self.old_wt *= self.old_wt_factor
+            if is_observation:
+                if self.weighted != value:
+                    self.weighted = (self.old_wt * self.weighted + value) / (self.old_wt + 1.)
+                self.old_wt += 1.
+        return self.weighted
+
+
+class StreamingMACD():
+    """EMA, MACD line, MACD signal and histogram of a price stream, updated in constant time per close
+
+    Values equal the last row of exponential_moving_avg, macd_line and macd_signal with center=False.
+    """
+    def __init__(self, window_size=15, ema1_window_size=12, ema2_window_size=26, signal_window_size=9):
+        self.ema = StreamingEMA(window_size)
+        self.ema1 = StreamingEMA(ema1_window_size)
+        self.ema2 = StreamingEMA(ema2_window_size)
+        self.signal = StreamingEMA(signal_window_size)
+
+    def reset(self):
+        for ema in [self.ema, self.ema1, self.ema2, self.signal]:
+            ema.reset()
+
+    def update(self, close: float) -> tuple:
+        """Ingests the next close, returns (EMA, MACD line, MACD signal, MACD histogram)"""
+        ema = self.ema.update(close)
+        macd_line = self.ema1.update(close) - self.ema2.update(close)
+        macd_signal = self.signal.update(macd_line)
+        return ema, macd_line, macd_signal, macd_line - macd_signal
@@ -1,6 +1,5 @@
 import pandas as pd
 import numpy as np
-import math
 import config
 
 def day_gain(df: pd.DataFrame, price_col=config.label_name, window_size=1):
@@ -108,63 +107,83 @@ def get_action_periods(df: pd.DataFrame, indicator_name: str) -> dict:
     Returns a dictionary containing:
     1. 'buy_periods'
     2. 'sell_periods'
+
+    A period starts on a row where the indicator rises (buy) or falls (sell) and runs while the market
+    action condition of the indicator holds. Scanning resumes two rows after the end of a period.
     """
+    values = df[indicator_name].to_numpy(dtype=float)
+    df_length = len(values)
+    buy_mask, sell_mask = _get_market_action_masks(df, indicator_name)
+    rising = np.zeros(df_length, dtype=bool)
+    falling = np.zeros(df_length, dtype=bool)
+    # Comparisons with nan are False, rows next to a nan never start a period
+    rising[1:] = values[1:] > values[:-1]
+    falling[1:] = values[1:] < values[:-1]
+
+    # First row at or after each row where the condition fails, the end of the run of rows it is in
+    buy_run_end = _next_false(buy_mask)
+    sell_run_end = _next_false(sell_mask)
+    # Only rows that rise into a buy or fall into a sell condition move the scan past the next row
+    candidates = np.flatnonzero((rising & buy_mask) | (falling & sell_mask))
+
     buy_periods = []
     sell_periods = []
-    i = 1
-    df_length = len(df)
-    while(i < df_length):
-        if math.isnan(df[indicator_name].iloc[i-1]) or math.isnan(df[indicator_name].iloc[i]):
-            pass
-        elif df[indicator_name].iloc[i] > df[indicator_name].iloc[i-1]:
-            start = df.index[i]
-            while(i < df_length and _is_market_action_condition(df, indicator_name, i, 'buy')):
-                i+=1
-            end = df.index[i-1]
-            if (start < end):
-                buy_periods.append([start, end])
-        elif df[indicator_name].iloc[i] < df[indicator_name].iloc[i-1]:
-            start = df.index[i]
-            while(i < df_length and _is_market_action_condition(df, indicator_name, i, 'sell')):
-                i+=1
-            end = df.index[i-1]
-            if (start < end):
-                sell_periods.append([start, end])
-        i+=1
+    index = df.index
+    k = 0
+    while k < len(candidates):
+        i = candidates[k]
+        if rising[i]:
+            run_end = buy_run_end[i]
+            periods = buy_periods
+        else:
+            run_end = sell_run_end[i]
+            periods = sell_periods
+        start = index[i]
+        end = index[run_end - 1]
+        if (start < end):
+            periods.append([start, end])
+        k = np.searchsorted(candidates, run_end + 1)
     return {'buy_periods': buy_periods, 'sell_periods': sell_periods}
 
-def _is_market_action_condition(df: pd.DataFrame, indicator_name: str, i: int, action: str) -> bool:
-    """Checks if the market action is correct for row i
+def _next_false(mask: np.ndarray) -> np.ndarray:
+    """For every row, the first row at or after it where mask is False, len(mask) if there is none
     """
-    if action == 'buy':
-        if indicator_name == 'MA':
-            return df['MA'].iloc[i] > df['MA'].iloc[i - 1]
-        elif indicator_name == 'EMA 10':
-            return df['EMA 10'].iloc[i] > df['EMA 20'].iloc[i]
-        elif indicator_name == 'MACD Line':
-            return df['MACD Line'].iloc[i] > df['MACD Signal'].iloc[i]
-        elif indicator_name == 'RSI':
-            return df['RSI'].iloc[i] < 30
-        elif indicator_name == 'Stochastic Oscillator %K':
-            return df['Stochastic Oscillator %K'].iloc[i] < 20 or ((not df['Stochastic Oscillator %K'].iloc[i] > 80) and df['Stochastic Oscillator %K'].iloc[i] > df['Stochastic Oscillator %D'].iloc[i])
-        elif indicator_name == 'CCI':
-            return df['CCI'].iloc[i] < -100
-        elif indicator_name == 'Money Flow':
-            return False
-    elif action == 'sell':
+    false_rows = np.where(mask, len(mask), np.arange(len(mask)))
+    return np.minimum.accumulate(false_rows[::-1])[::-1]
+
+def _get_market_action_masks(df: pd.DataFrame, indicator_name: str) -> tuple:
+    """Checks for every row if the market action is correct. Returns (buy mask, sell mask)
+    """
+    def column(name):
+        return df[name].to_numpy(dtype=float)
+
+    df_length = len(df)
+    with np.errstate(invalid='ignore'):
         if indicator_name == 'MA':
-            return df['MA'].iloc[i] < df['MA'].iloc[i - 1]
+            ma = column('MA')
+            buy = np.zeros(df_length, dtype=bool)
+            sell = np.zeros(df_length, dtype=bool)
+            buy[1:] = ma[1:] > ma[:-1]
+            sell[1:] = ma[1:] < ma[:-1]
         elif indicator_name == 'EMA 10':
-            return df['EMA 10'].iloc[i] < df['EMA 20'].iloc[i]
+            buy = column('EMA 10') > column('EMA 20')
+            sell = column('EMA 10') < column('EMA 20')
         elif indicator_name == 'MACD Line':
-            return df['MACD Line'].iloc[i] < df['MACD Signal'].iloc[i]
+            buy = column('MACD Line') > column('MACD Signal')
+            sell = column('MACD Line') < column('MACD Signal')
         elif indicator_name == 'RSI':
-            return df['RSI'].iloc[i] > 70
+            buy = column('RSI') < 30
+            sell = column('RSI') > 70
         elif indicator_name == 'Stochastic Oscillator %K':
-            return df['Stochastic Oscillator %K'].iloc[i] >80 or ((not df['Stochastic Oscillator %K'].iloc[i] < 20) and df['Stochastic Oscillator %K'].iloc[i] < df['Stochastic Oscillator %D'].iloc[i])
+            k = column('Stochastic Oscillator %K')
+            d = column('Stochastic Oscillator %D')
+            buy = (k < 20) | (~(k > 80) & (k > d))
+            sell = (k > 80) | (~(k < 20) & (k < d))
         elif indicator_name == 'CCI':
-            return df['CCI'].iloc[i] > 100
-        elif indicator_name == 'Money Flow':
-            return False
-    else:
-        raise Exception("Please check action parameter. Wrong input.")
+            buy = column('CCI') < -100
+            sell = column('CCI') > 100
+        else:
+            # Money Flow and unknown indicators never hold a market action
+            buy = np.zeros(df_length, dtype=bool)
+            sell = np.zeros(df_length, dtype=bool)
+    return buy, sell
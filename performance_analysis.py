@@ -4,7 +4,7 @@ from pathlib import Path
 import argparse
 import os
 import matplotlib.pyplot as plt
-from util.algo_dataset import get_algo_dataset
+from util.algo_dataset import get_algo_dataset, get_portfolio, get_portfolio_registry
 
 def read_nav_file(path):
     """Read NAV file safely"""
@@ -65,6 +65,9 @@ def analyze_portfolio_performance(portfolio_num):
     # Define paths for different approaches and prediction modes
     approaches = ['gradual', 'full_swing']
     prediction_modes = [False, True]
+    portfolio_name = get_portfolio(portfolio_num)['name']
+    # Get dataset for individual assets
+    df_list, date_range, trend_list, stocks, _ = get_algo_dataset(portfolio_num)
     
     for approach in approaches:
         for predict in prediction_modes:
@@ -73,14 +76,11 @@ def analyze_portfolio_performance(portfolio_num):
             if approach == 'full_swing':
                 subfolder = f'fs_{subfolder}'
             
-            base_path = f'data/rl/portfolio{portfolio_num+1}/{subfolder}'
+            base_path = f'data/rl/{portfolio_name}/{subfolder}'
             
 
             results = {}
             
-            # Get dataset for individual assets
-            df_list, date_range, trend_list, stocks = get_algo_dataset(portfolio_num)
-            
             # Analyze individual assets
             for i, stock in enumerate(stocks):
                 df = df_list[i]
@@ -103,5 +103,6 @@ def analyze_portfolio_performance(portfolio_num):
             
             print_performance_table(results, title)
 
-for i in range(3):
-    analyze_portfolio_performance(i)
\ No newline at end of file
+if __name__ == '__main__':
+    for i in range(len(get_portfolio_registry())):
+        analyze_portfolio_performance(i)
\ No newline at end of file
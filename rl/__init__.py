@@ -0,0 +1,7 @@
+from .state import *
+from .forecast import *
+from .replay import *
+from .qnetwork import *
+from .vec_env import *
+from .nav import *
+from .trainer import *
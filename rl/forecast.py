@@ -0,0 +1,68 @@
+import numpy as np
+import tensorflow as tf
+import hashlib
+from pathlib import Path
+import util
+from .state import get_price_window, get_indicator_df
+
+# The LSTM models look back 7 days and the state appends 3 forecast days
+lookback = 7
+forecast_days = 3
+
+def get_model_hash(model_file) -> str:
+    """sha1 of the model file, so a retrained model never reads forecasts of the old one
+    """
+    return hashlib.sha1(Path(model_file).read_bytes()).hexdigest()
+
+def min_max_scale(x: np.ndarray) -> tuple:
+    """Scales every window of x (windows, rows, features) to [0, 1] per feature
+
+    Same arithmetic as fitting MinMaxScaler(feature_range=(0, 1)) on each window. Returns (scaled, scale, min).
+    """
+    data_min = np.nanmin(x, axis=1)
+    data_range = np.nanmax(x, axis=1) - data_min
+    # Constant features keep a scale of 1, like sklearn
+    data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1.0
+    scale = 1.0 / data_range
+    min_ = 0 - data_min * scale
+    scaled = x * scale[:, np.newaxis, :]
+    scaled += min_[:, np.newaxis, :]
+    return scaled, scale, min_
+
+def get_forecast_inputs(indicator_array: np.ndarray) -> tuple:
+    """Builds the LSTM inputs of every window of indicator_array (windows, rows, [Close, EMA, MACD_Line, MACD_Signal])
+
+    Input j holds the features of the lookback days ending j days before the window end, most recent day first.
+    Returns (inputs (windows, forecast_days, lookback, features - 1), close scale, close min).
+    """
+    scaled, scale, min_ = min_max_scale(indicator_array)
+    rows = indicator_array.shape[1] - 1 - (np.arange(forecast_days)[:, np.newaxis] + np.arange(lookback)[np.newaxis, :])
+    return scaled[:, rows, 1:], scale[:, 0], min_[:, 0]
+
+def get_forecast_table(model_file, trend_list: list, price_panel, asset: int, price_period: int, cache_dir=None) -> np.ndarray:
+    """Returns a (len(trend_list), forecast_days) array of the forecast closes of asset after each trend date
+
+    The price windows are fixed per trend index, so all of them go through the model in one predict call and
+    the result is saved in cache_dir (default: the model's directory) keyed by asset, model hash and inputs.
+    """
+    model_file = Path(model_file)
+    date_idx_list = [price_panel.date_index[date] for date in trend_list]
+    price_array = np.array([get_price_window(price_panel, date_idx, asset, price_period)
+                            for date_idx in date_idx_list], dtype=np.float64)
+
+    digest = hashlib.sha1()
+    digest.update(price_array.tobytes())
+    cache_dir = model_file.parent if cache_dir is None else Path(cache_dir)
+    cache_file = cache_dir / f'forecast_{asset}_{get_model_hash(model_file)[:12]}_{digest.hexdigest()[:12]}.npy'
+    if cache_file.exists():
+        return np.load(cache_file)
+
+    indicator_array = np.array([get_indicator_df(price_list).values for price_list in price_array.tolist()])
+    inputs, close_scale, close_min = get_forecast_inputs(indicator_array)
+    model = tf.keras.models.load_model(str(model_file))
+    prediction = model.predict(inputs.reshape(-1, lookback, inputs.shape[-1]), verbose=0)
+    prediction = prediction.astype(np.float64).reshape(len(trend_list), forecast_days)
+    forecast_table = (prediction - close_min[:, np.newaxis]) / close_scale[:, np.newaxis]
+
+    util.save_array(cache_file, forecast_table)
+    return forecast_table
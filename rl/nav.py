@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+def simulate_daily_nav(prices: np.ndarray, rebalance_rows, compositions, asset_values,
+                       commisson_rate=1.0 / 800) -> np.ndarray:
+    """Daily asset values of a portfolio rebalanced to compositions[k] on prices row rebalance_rows[k]
+
+    Between rebalances every asset moves with its price relative to the last rebalance, so only the
+    rebalances are stepped through and the days in between are filled in one array operation.
+    Returns a (len(prices), assets) array.
+    """
+    rebalance_rows = np.asarray(rebalance_rows, dtype=np.int64)
+    compositions = np.asarray(compositions, dtype=np.float64).reshape(len(rebalance_rows), prices.shape[1])
+    # Prices row and asset values each day is valued from, the start before the first rebalance
+    base_rows = np.concatenate([[0], rebalance_rows])
+    base_values = np.empty((len(rebalance_rows) + 1, prices.shape[1]))
+    base_values[0] = asset_values
+    for k, row in enumerate(rebalance_rows):
+        grown_values = base_values[k] * prices[row] / prices[base_rows[k]]
+        amount_change = compositions[k] * grown_values.sum() - grown_values
+        # Increasing a composition incurs buy and sell commission
+        base_values[k + 1] = np.where(amount_change <= 0, grown_values + amount_change,
+                                      grown_values + amount_change * (1 - commisson_rate) ** 2)
+
+    segment = np.searchsorted(rebalance_rows, np.arange(len(prices)), side='right')
+    daily_values = base_values[segment] * prices / prices[base_rows[segment]]
+    daily_values[rebalance_rows] = base_values[1:]
+    return daily_values
+
+def get_daily_nav(price_panel, date_range: list, trend_list: list, portfolio_composition_list: list, stocks: list,
+                  start=10, asset_list=None, commisson_rate=1.0 / 800) -> tuple:
+    """Daily NAV of a portfolio rebalanced to portfolio_composition_list[j] on the j-th trend date from start
+
+    date_range must be the dates of price_panel and trend_list its trend dates.
+
+    Returns (daily_df with per asset values, 'Net' and 'Adjusted' columns, daily_price_df of the NAV rebased to 100).
+    """
+    asset_list = [100000] * len(stocks) if asset_list is None else list(asset_list)
+    trend_rows = price_panel.get_trend_rows(trend_list)
+    daily_values = simulate_daily_nav(price_panel.prices, trend_rows[start:-1], portfolio_composition_list, asset_list,
+                                      commisson_rate)
+    daily_net = daily_values.sum(axis=1)
+    # 'Adjusted' flags every trend date but the last
+    adjusted = (price_panel.is_trend.copy() if price_panel.trend_positions is not None
+                else price_panel.get_date_mask(trend_list))
+    adjusted[trend_rows[-1]] = False
+
+    daily_price_df = pd.DataFrame({'Date': date_range, 'Close': daily_net / sum(asset_list) * 100})
+    daily_df = pd.DataFrame({'Date': date_range,
+                             **{stock: daily_values[:, i] for i, stock in enumerate(stocks)},
+                             'Net': daily_net,
+                             'Adjusted': adjusted})
+    return daily_df, daily_price_df
+
+def get_passive_daily_nav(price_panel, dates: list, stocks: list, initial_asset=300000) -> pd.DataFrame:
+    """Buy and hold value of initial_asset in each asset on every date"""
+    prices = price_panel.prices[price_panel.get_rows(dates)]
+    passive_values = initial_asset * prices / prices[0]
+    return pd.DataFrame({'Date': dates, **{stock: passive_values[:, i] for i, stock in enumerate(stocks)}})
@@ -0,0 +1,165 @@
+import tensorflow as tf
+
+class Qnetwork():
+    """One hidden layer Q-value network taking a [batch, state_dimension] input
+
+    With trainable=False only the forward pass is built, for use as a target network. A trainable network
+    gets its update op from build_update, once its target network exists. seed fixes the initial weights
+    through the op seeds of their initialisers, so networks sharing a graph are seeded independently.
+
+    Variables are created in the same order as the original single-sample network, so checkpoints
+    saved by earlier versions of the training scripts still restore.
+    """
+    def __init__(self, H, state_dimension=5, num_actions=4, weight_decay_beta=float('10e-9'), learning_rate=0.001,
+                 trainable=True, seed=None):
+        self.learning_rate = learning_rate
+        sum_regularization = 0
+        self.x = tf.compat.v1.placeholder(tf.float32, [None, state_dimension])
+        self.W0 = tf.Variable(tf.random.uniform([state_dimension, H], 0, 1, seed=seed))
+        self.b0 = tf.Variable(tf.constant(0.1, shape=[H]))
+
+        self.y_hidden = tf.nn.relu(tf.matmul(self.x, self.W0) + self.b0)
+        sum_regularization += weight_decay_beta * tf.nn.l2_loss(self.W0)
+
+        self.W1 = tf.Variable(tf.random.uniform([H, num_actions], 0, 1, seed=None if seed is None else seed + 1))
+        self.b1 = tf.Variable(tf.constant(0.1, shape=[num_actions]))
+        sum_regularization += weight_decay_beta * tf.nn.l2_loss(self.W1)
+        self.variables = [self.W0, self.b0, self.W1, self.b1]
+        # q out
+        self.q_values = tf.matmul(self.y_hidden, self.W1) + self.b1
+        # predict
+        self.best_action = tf.argmax(self.q_values, 1)
+
+        # A target network is only ever assigned to, it needs no loss or optimizer
+        if not trainable:
+            return
+        self.sum_regularization = sum_regularization
+        # Actions taken and rewards of a minibatch, whose states are fed to x
+        self.actions = tf.compat.v1.placeholder(tf.int64, [None])
+        self.rewards = tf.compat.v1.placeholder(tf.float32, [None])
+
+    def build_update(self, target_QN, gamma: float, tau: float):
+        """Builds update, one Adam step towards the Q learning targets of a minibatch, and update_and_sync
+
+        The minibatch is fed to x, actions, rewards and the next states to target_QN.x, so the targets come
+        from target_QN in the same run. update_and_sync also soft updates target_QN by tau once the step is
+        applied.
+        """
+        target = get_td_target(self.q_values, self.actions, self.rewards, target_QN.q_values, gamma)
+        # Per sample loss is unchanged from the single sample network, averaged over the batch
+        self.loss = tf.reduce_mean(tf.reduce_sum(tf.square(target - self.q_values) + self.sum_regularization, axis=1))
+        self.update = tf.compat.v1.train.AdamOptimizer(learning_rate=self.learning_rate).minimize(self.loss)
+        with tf.control_dependencies([self.update]):
+            self.update_and_sync = get_target_update_op(self.variables, target_QN.variables, tau)
+
+
+def get_td_target(q_values, actions, rewards, next_q_values, gamma: float):
+    """q_values with the Q value of every action taken replaced by r + gamma * max Q(s'), a constant of the loss"""
+    indices = tf.stack([tf.range(tf.shape(actions, out_type=actions.dtype)[0]), actions], axis=1)
+    return tf.stop_gradient(tf.tensor_scatter_nd_update(q_values, indices,
+                                                        rewards + gamma * tf.reduce_max(next_q_values, axis=1)))
+
+
+def get_target_update_op(main_variables: list, target_variables: list, tau: float):
+    """Single op moving every target variable tau of the way towards its main network variable
+
+    tau=1 copies the main network into the target network.
+    """
+    return tf.group(*[target.assign(tau * main + (1 - tau) * target)
+                      for main, target in zip(main_variables, target_variables)])
+
+
+# Names the variables of a Qnetwork take in an unscoped graph, in the order W0, b0, W1, b1
+checkpoint_variable_names = ['Variable', 'Variable_1', 'Variable_2', 'Variable_3']
+
+
+class CompiledQnetwork():
+    """Qnetwork for eager execution, holding its own target network
+
+    The greedy action and the training step each run as one tf.function, XLA compiled with jit_compile. The
+    training step takes the max Q of s' from the target network, the Q values of s, the loss and its
+    gradients and applies the Adam update in one call. Initialisation, loss and Adam update follow Qnetwork
+    and tf.compat.v1.train.AdamOptimizer, and checkpoints are read and written under the names of the graph
+    network, so models move freely between the two.
+    """
+    def __init__(self, H, state_dimension=5, num_actions=4, weight_decay_beta=float('10e-9'), learning_rate=0.001,
+                 gamma=.99, tau=0.0005, jit_compile=False, beta1=0.9, beta2=0.999, epsilon=1e-8, seed=None):
+        self.weight_decay_beta = weight_decay_beta
+        self.learning_rate = learning_rate
+        self.gamma = gamma
+        self.tau = tau
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+        self.W0 = tf.Variable(tf.random.uniform([state_dimension, H], 0, 1, seed=seed))
+        self.b0 = tf.Variable(tf.constant(0.1, shape=[H]))
+        self.W1 = tf.Variable(tf.random.uniform([H, num_actions], 0, 1, seed=None if seed is None else seed + 1))
+        self.b1 = tf.Variable(tf.constant(0.1, shape=[num_actions]))
+        self.variables = [self.W0, self.b0, self.W1, self.b1]
+        self.target_variables = [tf.Variable(variable, trainable=False) for variable in self.variables]
+
+        # Adam moments and the powers of its decay rates, starting at the rates as in AdamOptimizer
+        self.adam_m = [tf.Variable(tf.zeros_like(variable), trainable=False) for variable in self.variables]
+        self.adam_v = [tf.Variable(tf.zeros_like(variable), trainable=False) for variable in self.variables]
+        self.beta1_power = tf.Variable(beta1, dtype=tf.float32, trainable=False)
+        self.beta2_power = tf.Variable(beta2, dtype=tf.float32, trainable=False)
+
+        # Batch sizes differ between acting, training and evaluation, so shapes are traced generically
+        self.best_action = tf.function(self._best_action, jit_compile=jit_compile, reduce_retracing=True)
+        self.q_values = tf.function(self._q_values, jit_compile=jit_compile, reduce_retracing=True)
+        self.learn = tf.function(self._learn, jit_compile=jit_compile, reduce_retracing=True)
+
+    @staticmethod
+    def _forward(variables: list, x):
+        W0, b0, W1, b1 = variables
+        y_hidden = tf.nn.relu(tf.matmul(x, W0) + b0)
+        return tf.matmul(y_hidden, W1) + b1
+
+    def _q_values(self, x):
+        return self._forward(self.variables, x)
+
+    def _best_action(self, x):
+        return tf.argmax(self._forward(self.variables, x), 1)
+
+    def _learn(self, states, actions, rewards, next_states, update_target):
+        """One Adam step on a minibatch, then the soft target update if update_target. Returns the loss"""
+        next_q_values = self._forward(self.target_variables, next_states)
+        with tf.GradientTape() as tape:
+            q_values = self._forward(self.variables, states)
+            target = get_td_target(q_values, actions, rewards, next_q_values, self.gamma)
+            sum_regularization = (self.weight_decay_beta * tf.nn.l2_loss(self.W0)
+                                  + self.weight_decay_beta * tf.nn.l2_loss(self.W1))
+            loss = tf.reduce_mean(tf.reduce_sum(tf.square(target - q_values) + sum_regularization, axis=1))
+        gradients = tape.gradient(loss, self.variables)
+
+        learning_rate = self.learning_rate * tf.sqrt(1 - self.beta2_power) / (1 - self.beta1_power)
+        for variable, m, v, gradient in zip(self.variables, self.adam_m, self.adam_v, gradients):
+            m.assign_add((gradient - m) * (1 - self.beta1))
+            v.assign_add((tf.square(gradient) - v) * (1 - self.beta2))
+            variable.assign_sub(learning_rate * m / (tf.sqrt(v) + self.epsilon))
+        self.beta1_power.assign(self.beta1_power * self.beta1)
+        self.beta2_power.assign(self.beta2_power * self.beta2)
+
+        if update_target:
+            self._update_target(self.tau)
+        return loss
+
+    def _update_target(self, tau: float):
+        for main, target in zip(self.variables, self.target_variables):
+            target.assign(tau * main + (1 - tau) * target)
+
+    def copy_to_target(self):
+        self._update_target(1.0)
+
+    def save(self, checkpoint_path: str):
+        """Writes the main network as a graph Qnetwork checkpoint"""
+        saver = tf.compat.v1.train.Saver(dict(zip(checkpoint_variable_names, self.variables)))
+        saver.save(None, checkpoint_path)
+
+    def restore(self, checkpoint_path: str):
+        """Reads the main network from a graph Qnetwork checkpoint and copies it into the target network"""
+        reader = tf.train.load_checkpoint(checkpoint_path)
+        for name, variable in zip(checkpoint_variable_names, self.variables):
+            variable.assign(reader.get_tensor(name))
+        self.copy_to_target()
@@ -0,0 +1,43 @@
+import numpy as np
+
+class ReplayBuffer():
+    """Ring buffer of (s, a, r, s') transitions kept in preallocated arrays
+
+    Minibatches are drawn with rng, a numpy Generator, so a seeded generator makes the sampling reproducible.
+    """
+    def __init__(self, buffer_size: int, state_dimension: int, rng=None):
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.buffer_size = buffer_size
+        self.states = np.zeros((buffer_size, state_dimension), dtype=np.float32)
+        self.actions = np.zeros(buffer_size, dtype=np.int64)
+        self.rewards = np.zeros(buffer_size, dtype=np.float32)
+        self.next_states = np.zeros((buffer_size, state_dimension), dtype=np.float32)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action: int, reward: float, next_state):
+        """Stores one transition, overwriting the oldest one when the buffer is full"""
+        self.states[self.position] = state
+        self.actions[self.position] = action
+        self.rewards[self.position] = reward
+        self.next_states[self.position] = next_state
+        self.position = (self.position + 1) % self.buffer_size
+        self.size = min(self.size + 1, self.buffer_size)
+
+    def add_batch(self, states, actions, rewards, next_states):
+        """Stores one transition per row of the arguments"""
+        idx = (self.position + np.arange(len(actions))) % self.buffer_size
+        self.states[idx] = states
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.next_states[idx] = next_states
+        self.position = (self.position + len(actions)) % self.buffer_size
+        self.size = min(self.size + len(actions), self.buffer_size)
+
+    def sample(self, batch_size: int) -> tuple:
+        """Returns (states, actions, rewards, next_states) of batch_size transitions drawn uniformly"""
+        idx = self.rng.integers(0, self.size, size=batch_size)
+        return self.states[idx], self.actions[idx], self.rewards[idx], self.next_states[idx]
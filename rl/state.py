@@ -0,0 +1,109 @@
+import indicators
+import util
+import numpy as np
+import pandas as pd
+import math
+import hashlib
+from pathlib import Path
+
+def get_price_window(price_panel, date_idx: int, asset: int, price_period: int) -> list:
+    """Returns the price_period closes before date_idx, zero padded in front when there is not enough history
+    """
+    if date_idx - price_period >= 0:
+        return price_panel.prices[date_idx - price_period:date_idx, asset].tolist()
+    return [0] * (price_period - date_idx) + price_panel.prices[0:date_idx, asset].tolist()
+
+def get_indicator_df(price_list: list) -> pd.DataFrame:
+    df = pd.DataFrame({'Close': price_list})
+    df['EMA'] = indicators.exponential_moving_avg(df, window_size=6, center=False)
+    df['MACD_Line'] = indicators.macd_line(df, ema1_window_size=3, ema2_window_size=6, center=False)
+    df['MACD_Signal'] = indicators.macd_signal(df, window_size=6, ema1_window_size=3, ema2_window_size=6,
+                                               center=False)
+    return df
+
+def get_predicted_indicator_df(price_list: list, pred_close) -> pd.DataFrame:
+    """Indicators centered on the last known day, using the forecast closes that follow it
+    """
+    df = pd.DataFrame({'Close': list(price_list) + list(pred_close)})
+    df['EMA'] = indicators.exponential_moving_avg(df, window_size=6, center=True)
+    df['MACD_Line'] = indicators.macd_line(df, ema1_window_size=3, ema2_window_size=6, center=True)
+    df['MACD_Signal'] = indicators.macd_signal(df, window_size=6, ema1_window_size=3, ema2_window_size=6, center=True)
+    return df.iloc[3:-3]
+
+def get_indicator_state(df: pd.DataFrame) -> tuple:
+    """Returns (normalised EMA, scaled MACD histogram) of the last row of df
+    """
+    ema_price = util.z_score_normalization(df.iloc[-1]['EMA'], df['EMA'].tolist())
+    macd_line = df['MACD_Line']
+    macd_signal = df['MACD_Signal']
+    macd = [macd_line.iloc[i] - macd_signal.iloc[i] for i in range(len(macd_line))]
+    macd = util.scale(macd[-1], macd)
+    if (math.isnan(ema_price) or math.isnan(macd)):
+        print(f'nan encountered: ema = {ema_price}, macd = {macd}')
+    return ema_price, macd
+
+def get_streaming_indicator_state(price_list: list) -> tuple:
+    """Same as get_indicator_state(get_indicator_df(price_list)), streaming the closes instead of using pandas
+    """
+    macd = indicators.StreamingMACD(window_size=6, ema1_window_size=3, ema2_window_size=6, signal_window_size=6)
+    ema_list = []
+    histogram_list = []
+    for close in price_list:
+        ema, _, _, histogram = macd.update(close)
+        ema_list.append(ema)
+        histogram_list.append(histogram)
+    ema_price = util.z_score_normalization(ema_list[-1], ema_list)
+    histogram = util.scale(histogram_list[-1], histogram_list)
+    if (math.isnan(ema_price) or math.isnan(histogram)):
+        print(f'nan encountered: ema = {ema_price}, macd = {histogram}')
+    return ema_price, histogram
+
+def get_state(trend_idx: int, trend_list: list, price_panel, price_period: int, state_assets=2, forecast_list=None) -> tuple:
+    """State observed at trend_list[trend_idx]
+
+    forecast_list holds one (len(trend_list), 3) forecast close array per state asset. When given, the
+    indicators are centered using the forecast days.
+    """
+    date_idx = price_panel.date_index[trend_list[trend_idx]]
+    state_ = ()
+    for i in range(state_assets):
+        # Get the price_period num of days price before the trend date
+        price_list = get_price_window(price_panel, date_idx, i, price_period)
+        if forecast_list is None:
+            state_ += get_streaming_indicator_state(price_list)
+        else:
+            df = get_predicted_indicator_df(price_list, forecast_list[i][trend_idx])
+            state_ += get_indicator_state(df)
+
+    if trend_idx == 0:
+        last_date_delta = 0
+    else:
+        last_date_delta = (trend_list[trend_idx] - trend_list[trend_idx - 1]).days
+
+    state_ += (last_date_delta,)
+    return state_
+
+def get_state_table(trend_list: list, price_panel, price_period: int, state_assets=2, forecast_list=None, cache_dir=None) -> np.ndarray:
+    """Returns a (len(trend_list), 2 * state_assets + 1) float32 array whose row k is the state at trend_list[k]
+
+    The states do not depend on the actions taken, so they are built once per dataset. With cache_dir the
+    table is saved there under a digest of its inputs and reused by later runs.
+    """
+    cache_file = None
+    if cache_dir is not None:
+        digest = hashlib.sha1()
+        digest.update(np.array([price_period, state_assets]).tobytes())
+        digest.update(pd.DatetimeIndex(trend_list).asi8.tobytes())
+        digest.update(price_panel.prices.tobytes())
+        if forecast_list is not None:
+            for forecast_table in forecast_list:
+                digest.update(np.asarray(forecast_table, dtype=np.float64).tobytes())
+        cache_file = Path(cache_dir) / f'state_{digest.hexdigest()[:16]}.npy'
+        if cache_file.exists():
+            return np.load(cache_file)
+
+    state_table = np.array([get_state(k, trend_list, price_panel, price_period, state_assets, forecast_list)
+                            for k in range(len(trend_list))], dtype=np.float32)
+    if cache_file is not None:
+        util.save_array(cache_file, state_table)
+    return state_table
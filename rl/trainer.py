@@ -0,0 +1,182 @@
+import contextlib
+import numpy as np
+import tensorflow as tf
+from .qnetwork import CompiledQnetwork, Qnetwork, get_target_update_op
+from .replay import ReplayBuffer
+from .vec_env import VecPortfolioEnv
+
+class Trainer():
+    """Deep Q learning on a VecPortfolioEnv with experience replay and a soft updated target network
+
+    Episodes run whole with run_episode, or one step at a time with start_episode, step and end_episode so that
+    several trainers can be interleaved in one session. Trainers sharing a graph build their networks in
+    variable scopes of their own.
+    """
+    def __init__(self, env: VecPortfolioEnv, h_size=100, state_dimension=None, num_actions=None,
+                 weight_decay_beta=float('10e-9'), learning_rate=0.001, batch_size=32, buffer_size=1000000,
+                 update_freq=10, gamma=.99, tau=0.0005, start_e=1, end_e=0.1, annealing_steps=5000,
+                 pre_train_steps=84400, total_steps=0, start_composition=None, start_assets=None, seed=None,
+                 scope=None):
+        self.env = env
+        # Sizes default to those of the environment's state table and action table
+        state_dimension = env.state_table.shape[1] if state_dimension is None else state_dimension
+        num_actions = env.action_table.num_actions if num_actions is None else num_actions
+        self.num_actions = num_actions
+        self.batch_size = batch_size
+        self.update_freq = update_freq
+        self.gamma = gamma
+        self.end_e = end_e
+        self.pre_train_steps = pre_train_steps
+        num_assets = env.prices.shape[1]
+        # Episodes start from the last asset's full swing target, (0.1, 0.1, 0.8) for three assets
+        self.start_composition = list(env.action_table.start_composition if start_composition is None
+                                      else start_composition)
+        self.start_assets = list([100000] * num_assets if start_assets is None else start_assets)
+        # seed also fixes the initial network weights
+        self.seed = seed
+
+        self.build_networks(h_size, state_dimension, num_actions, weight_decay_beta, learning_rate, tau, scope)
+        # Exploration and minibatch sampling draw from the same seeded generator
+        self.rng = np.random.default_rng(seed)
+        self.replay_buffer = ReplayBuffer(buffer_size, state_dimension, self.rng)
+
+        # Set the rate of random action decrease.
+        self.e_rate = start_e
+        self.step_drop = (start_e - end_e) / annealing_steps
+        self.total_steps = total_steps
+        self.update_steps = 0
+        self.states = None
+        self.ep_rewards = None
+
+    def build_networks(self, h_size, state_dimension, num_actions, weight_decay_beta, learning_rate, tau, scope):
+        with tf.compat.v1.variable_scope(scope) if scope else contextlib.nullcontext():
+            self.main_QN = Qnetwork(h_size, state_dimension, num_actions, weight_decay_beta, learning_rate,
+                                    seed=self.seed)
+            self.target_QN = Qnetwork(h_size, state_dimension, num_actions, trainable=False)
+            self.main_QN.build_update(self.target_QN, self.gamma, tau)
+            self.target_init = get_target_update_op(self.main_QN.variables, self.target_QN.variables, 1.0)
+        # Only the main network is checkpointed, the target network is rebuilt from it. Checkpoints hold the
+        # names of an unscoped graph, so models trained in a scope load in a graph of their own and back
+        prefix = f'{scope}/' if scope else ''
+        self.saver = tf.compat.v1.train.Saver({variable.op.name[len(prefix):]: variable
+                                               for variable in self.main_QN.variables})
+
+    def initialize(self, sess):
+        """Copies the freshly initialised main network into the target network"""
+        sess.run(self.target_init)
+
+    def start_episode(self):
+        self.states = self.env.reset(self.start_composition, self.start_assets)
+        self.ep_rewards = np.zeros(self.env.num_envs)
+
+    def step(self, sess) -> bool:
+        """Takes one action in every portfolio and trains on a minibatch. Returns True when the episode is over"""
+        num_envs = self.env.num_envs
+        actions = self.get_actions(sess, self.states)
+        # Explore, every portfolio draws from the same generator independently
+        explore = self.rng.random(num_envs) < self.e_rate
+        if self.total_steps < self.pre_train_steps:
+            explore[:] = True
+        actions = np.where(explore, self.rng.integers(0, self.num_actions, num_envs), actions)
+
+        next_states, step_rewards = self.env.step(actions)
+        self.ep_rewards += step_rewards
+        self.replay_buffer.add_batch(self.states, actions, step_rewards, next_states)
+        self.total_steps += num_envs
+
+        # Train on a minibatch of past transitions
+        if len(self.replay_buffer) >= self.batch_size:
+            self.update_steps += 1
+            self.train_batch(sess, *self.replay_buffer.sample(self.batch_size),
+                             update_target=self.update_steps % self.update_freq == 0)
+
+        # Reduce exploration rate
+        if self.total_steps > self.pre_train_steps:
+            if self.e_rate > self.end_e:
+                self.e_rate -= self.step_drop * num_envs
+
+        self.states = next_states
+        return self.env.done
+
+    def get_actions(self, sess, states) -> np.ndarray:
+        """Greedy action of every state"""
+        return sess.run(self.main_QN.best_action, feed_dict={self.main_QN.x: states})
+
+    def train_batch(self, sess, states, actions, rewards, next_states, update_target=False):
+        """One update of the main network towards the Q learning targets, then the soft target update if asked
+
+        The targets, the update and the soft target update all run in one call.
+        """
+        sess.run(self.main_QN.update_and_sync if update_target else self.main_QN.update,
+                 feed_dict={self.main_QN.x: states, self.main_QN.actions: actions, self.main_QN.rewards: rewards,
+                            self.target_QN.x: next_states})
+
+    def end_episode(self) -> tuple:
+        """Returns (mean final NAV, mean episode reward) over the portfolios"""
+        _, navs = self.env.final_nav()
+        return np.mean(navs), np.mean(self.ep_rewards)
+
+    def run_episode(self, sess) -> tuple:
+        self.start_episode()
+        while not self.step(sess):
+            pass
+        return self.end_episode()
+
+    def save(self, sess, path: str):
+        self.saver.save(sess, path + '/model.cptk')
+
+    def restore(self, sess, path: str):
+        ckpt = tf.train.get_checkpoint_state(path)
+        print(ckpt.model_checkpoint_path)
+        self.saver.restore(sess, ckpt.model_checkpoint_path)
+
+
+class CompiledTrainer(Trainer):
+    """Trainer on a CompiledQnetwork, running eagerly without a graph or session
+
+    Every minibatch update is one call of the compiled training step, XLA compiled with jit_compile. Methods
+    take the same arguments as those of Trainer and ignore the session, so the loops written for Trainer
+    drive it unchanged. Its checkpoints are those of Trainer.
+    """
+    def __init__(self, env: VecPortfolioEnv, *args, jit_compile=False, **kwargs):
+        self.jit_compile = jit_compile
+        super().__init__(env, *args, **kwargs)
+
+    def build_networks(self, h_size, state_dimension, num_actions, weight_decay_beta, learning_rate, tau, scope):
+        # Eager variables do not share a graph, scope is only accepted to match Trainer
+        self.main_QN = CompiledQnetwork(h_size, state_dimension, num_actions, weight_decay_beta, learning_rate,
+                                        self.gamma, tau, self.jit_compile, seed=self.seed)
+
+    def initialize(self, sess=None):
+        self.main_QN.copy_to_target()
+
+    def get_actions(self, sess, states) -> np.ndarray:
+        return self.main_QN.best_action(states).numpy()
+
+    def train_batch(self, sess, states, actions, rewards, next_states, update_target=False):
+        self.main_QN.learn(states, actions, rewards, next_states, tf.constant(update_target))
+
+    def save(self, sess, path: str):
+        self.main_QN.save(path + '/model.cptk')
+
+    def restore(self, sess, path: str):
+        ckpt = tf.train.get_checkpoint_state(path)
+        print(ckpt.model_checkpoint_path)
+        self.main_QN.restore(ckpt.model_checkpoint_path)
+
+
+def evaluate_policy(sess, trainer: Trainer, env: VecPortfolioEnv, portfolio_composition, asset_list) -> tuple:
+    """Follows the greedy policy of the trainer's main network through a one portfolio environment
+
+    States do not depend on the actions taken, so the actions of every trend date come from one batched
+    forward pass and are then replayed through the environment.
+    Returns (composition chosen on every trend date, final NAV).
+    """
+    actions = trainer.get_actions(sess, env.state_table[env.start:len(env.trend_list) - 1])
+    env.reset(portfolio_composition, asset_list)
+    portfolio_composition_list = []
+    for action in actions:
+        env.step(action[np.newaxis])
+        portfolio_composition_list.append(env.portfolio_compositions[0].tolist())
+    _, navs = env.final_nav()
+    return portfolio_composition_list, navs[0]
@@ -0,0 +1,188 @@
+import numpy as np
+
+import util
+
+# Gradual: (from asset, to asset) moves of the three asset portfolios the saved models were trained with
+three_asset_gradual_moves = np.array([[[2, 0], [1, 0]],
+                                      [[0, 1], [2, 1]],
+                                      [[0, 2], [1, 2]],
+                                      [[0, 2], [1, 2]]])
+
+class ActionTable():
+    """Actions of an N asset portfolio whose assets are ordered from the highest to the lowest risk
+
+    The state assets are all assets but the last. There is one action per state asset, one for all state
+    assets together and one for the last asset:
+    - full swing action a rebalances to the target composition full_swing_compositions[a], which gives the
+      free weight to the action's assets and the base rate to every other asset
+    - gradual action a shifts step along its (from asset, to asset) rows of gradual_moves, tried in order,
+      repeats times, wherever the asset given up keeps its base rate. The action of all state assets shifts
+      weight from the last asset into every state asset, towards its full swing target. Only the three asset
+      table, which the saved models were trained with, keeps its action moving to the last asset instead
+    """
+    def __init__(self, num_assets=3, base_rate=None, repeats=3):
+        self.num_assets = num_assets
+        self.base_rate = util.get_base_rate(num_assets) if base_rate is None else base_rate
+        self.step = self.base_rate
+        self.repeats = repeats
+
+        action_assets = [[i] for i in range(num_assets - 1)] + [list(range(num_assets - 1)), [num_assets - 1]]
+        self.full_swing_compositions = np.full((len(action_assets), num_assets), self.base_rate)
+        for a, assets in enumerate(action_assets):
+            # What the other assets leave, 1 - 0.2 = 0.8 where 0.1 + 0.7 would give 0.7999999999999999
+            self.full_swing_compositions[a, assets] = (1 - self.base_rate * (num_assets - len(assets))) / len(assets)
+
+        if num_assets == 3:
+            self.gradual_moves = three_asset_gradual_moves
+        else:
+            last = num_assets - 1
+            into_state_asset = [[[source, target] for source in range(num_assets) if source != target]
+                                for target in range(last)]
+            into_state_assets = [[[last, target] for target in range(last)]]
+            into_last_asset = [[[source, last] for source in range(last)]]
+            self.gradual_moves = np.array(into_state_asset + into_state_assets + into_last_asset)
+
+    @property
+    def num_actions(self) -> int:
+        return len(self.full_swing_compositions)
+
+    @property
+    def start_composition(self) -> np.ndarray:
+        """Base rate in every asset and the free weight in the last one"""
+        return self.full_swing_compositions[-1]
+
+    def full_swing(self, actions: np.ndarray) -> np.ndarray:
+        return self.full_swing_compositions[actions].copy()
+
+    def gradual(self, actions: np.ndarray, portfolio_compositions: np.ndarray) -> np.ndarray:
+        new_compositions = portfolio_compositions.copy()
+        env_idx = np.arange(len(actions))
+        for _ in range(self.repeats):
+            for move in range(self.gradual_moves.shape[1]):
+                from_asset = self.gradual_moves[actions, move, 0]
+                to_asset = self.gradual_moves[actions, move, 1]
+                # Only move when the base rate of the asset given up stays covered
+                can_move = new_compositions[env_idx, from_asset] - self.step >= self.base_rate
+                new_compositions[env_idx[can_move], to_asset[can_move]] += self.step
+                new_compositions[env_idx[can_move], from_asset[can_move]] -= self.step
+        return new_compositions
+
+class VecPortfolioEnv():
+    """Steps num_envs independent portfolios over the same trend dates in lockstep
+
+    Compositions and asset values are (num_envs, assets) arrays and every step takes one action per portfolio,
+    an index into action_table, which defaults to the ActionTable of the number of assets of price_panel.
+    The arithmetic is the same as the single portfolio reward and NAV functions of the training scripts, so
+    a one portfolio environment reproduces them exactly.
+    """
+    def __init__(self, price_panel, trend_list: list, state_table: np.ndarray, num_envs=1, full_swing=False,
+                 reward_period=15, commisson_rate=1.0 / 800, start=10, action_table=None):
+        self.prices = price_panel.prices
+        self.action_table = ActionTable(self.prices.shape[1]) if action_table is None else action_table
+        self.trend_list = trend_list
+        self.trend_rows = price_panel.get_trend_rows(trend_list)
+        self.state_table = state_table
+        self.num_envs = num_envs
+        self.full_swing = full_swing
+        self.reward_period = reward_period
+        self.commisson_rate = commisson_rate
+        self.start = start
+        self.position = start
+        self.portfolio_compositions = None
+        self.asset_values = None
+
+    @property
+    def done(self) -> bool:
+        return self.position >= len(self.trend_list) - 1
+
+    def reset(self, portfolio_composition, asset_list):
+        """Starts every portfolio at the start trend index. Both arguments broadcast to (num_envs, assets)
+
+        Returns the (num_envs, state_dimension) states.
+        """
+        assets = self.prices.shape[1]
+        self.portfolio_compositions = np.broadcast_to(np.asarray(portfolio_composition, dtype=np.float64),
+                                                      (self.num_envs, assets)).copy()
+        self.asset_values = np.broadcast_to(np.asarray(asset_list, dtype=np.float64),
+                                            (self.num_envs, assets)).copy()
+        self.position = self.start
+        return self.get_states()
+
+    def get_states(self) -> np.ndarray:
+        return np.repeat(self.state_table[self.position][np.newaxis], self.num_envs, axis=0)
+
+    def step(self, actions) -> tuple:
+        """Applies one action per portfolio at the current trend date and moves to the next one
+
+        Returns (next states, rewards).
+        """
+        rewards, self.portfolio_compositions, self.asset_values = self.get_reward(
+            self.asset_values, np.asarray(actions), self.position, self.portfolio_compositions)
+        self.position += 1
+        return self.get_states(), rewards
+
+    def process_action(self, actions: np.ndarray, portfolio_compositions: np.ndarray) -> np.ndarray:
+        if self.full_swing:
+            return self.action_table.full_swing(actions)
+        return self.action_table.gradual(actions, portfolio_compositions)
+
+    def get_reward_asset_sum(self, asset_values, compositions, current_row: int, reward_row: int) -> tuple:
+        """Asset values moved from current_row to reward_row prices and rebalanced to compositions"""
+        temp_asset_values = asset_values * self.prices[reward_row] / self.prices[current_row]
+        total_assets = temp_asset_values.sum(axis=1, keepdims=True)
+        amount_change = compositions * total_assets - asset_values
+        temp_asset_values = np.where(amount_change <= 0, temp_asset_values + amount_change,
+                                     temp_asset_values + amount_change * (1 - self.commisson_rate) ** 2)
+        return temp_asset_values.sum(axis=1), temp_asset_values
+
+    def calc_actions_nav(self, asset_values, compositions, index: int) -> tuple:
+        """Asset values moved from the previous trend date to trend index and rebalanced to compositions"""
+        prev_row = 0 if index == self.start - 1 else self.trend_rows[index - 1]
+        new_asset_values = asset_values * self.prices[self.trend_rows[index]] / self.prices[prev_row]
+        total_assets = new_asset_values.sum(axis=1, keepdims=True)
+        amount_change = compositions * total_assets - new_asset_values
+        new_asset_values = np.where(amount_change <= 0, new_asset_values + amount_change,
+                                    new_asset_values + amount_change * (1 - self.commisson_rate) ** 2)
+        return new_asset_values, new_asset_values.sum(axis=1)
+
+    def final_nav(self) -> tuple:
+        """Asset values moved from the last trend date to the last date. Returns (asset values, NAV)"""
+        asset_values = self.asset_values * self.prices[-1] / self.prices[self.trend_rows[-1]]
+        return asset_values, asset_values.sum(axis=1)
+
+    def get_reward(self, asset_values, actions, index: int, compositions) -> tuple:
+        date_row = self.trend_rows[index]
+        if date_row + self.reward_period < len(self.prices):
+            reward_row = date_row + self.reward_period
+        else:
+            reward_row = len(self.prices) - 1
+
+        passive_asset_sum, _ = self.get_reward_asset_sum(asset_values, compositions, date_row, reward_row)
+        changed_compositions = self.process_action(actions, compositions)
+        nav_asset_values, nav_reward = self.calc_actions_nav(asset_values, compositions, index)
+        if self.full_swing:
+            changed_asset_sum, _ = self.get_reward_asset_sum(asset_values, changed_compositions, date_row,
+                                                             reward_row)
+            new_asset_values = nav_asset_values
+        else:
+            # Rebalance daily for up to 3 days, stopping at the next trend date
+            changed_asset_values = asset_values
+            rebalance_days = min(3, self.reward_period, self.trend_rows[index + 1] - date_row,
+                                 len(self.prices) - date_row)
+            for i in range(rebalance_days):
+                changed_asset_sum, changed_asset_values = self.get_reward_asset_sum(
+                    changed_asset_values, changed_compositions, date_row + i, date_row + i + 1)
+            new_asset_values = changed_asset_values
+            nav_reward = changed_asset_sum
+
+        # No change in value from the action, only the passive NAV update
+        unchanged = (changed_asset_sum - passive_asset_sum == 0) | (passive_asset_sum == 0)
+        new_asset_values = np.where(unchanged[:, np.newaxis], nav_asset_values, new_asset_values)
+
+        trend_list_len = len(self.trend_list)
+        # scale to 0.5-1 depending on trend position
+        time_scaling_factor = 0.5 * (trend_list_len - index) / trend_list_len + 0.5
+        with np.errstate(divide='ignore', invalid='ignore'):
+            reward = (changed_asset_sum - passive_asset_sum) / passive_asset_sum * time_scaling_factor
+        rewards = np.where(unchanged, 0, reward + nav_reward / 10000000)
+        return rewards, changed_compositions, new_asset_values
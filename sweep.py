@@ -0,0 +1,147 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from performance_analysis import read_nav_file, calculate_nav_metrics
+
+# Parameters that are passed on as train.py flags, everything else in the grid is rejected
+sweep_params = ['price_period', 'reward_period', 'h_size', 'learning_rate', 'num_episodes', 'full_swing', 'seed',
+                'num_envs']
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_trials(grid: dict) -> list:
+    """Expand a parameter grid {name: [values]} into a list of trial parameter dicts"""
+    unknown = set(grid) - set(sweep_params)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters: {sorted(unknown)}')
+    names = sorted(grid)
+    values = [v if isinstance(v, list) else [v] for v in (grid[name] for name in names)]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def get_trial_name(params: dict) -> str:
+    """Stable directory name of a trial, so that a rerun finds the trials it already finished"""
+    if not params:
+        return 'default'
+    return '_'.join(f'{name}={params[name]}' for name in sorted(params))
+
+
+def get_trial_flags(params: dict) -> list:
+    flags = []
+    for name in sorted(params):
+        if name == 'full_swing':
+            if params[name]:
+                flags.append('--full_swing')
+        else:
+            flags += [f'--{name}', str(params[name])]
+    return flags
+
+
+def run_trial(base_argv: list, params: dict, trial_dir: str, threads: int) -> dict:
+    """Train and evaluate one trial in a fresh worker process, returns its summary row"""
+    # Thread limits have to be set before tensorflow is imported
+    for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS',
+                'TF_NUM_INTEROP_THREADS']:
+        os.environ[var] = str(threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    # The dataset is read through relative paths
+    os.chdir(repo_dir)
+    import train
+
+    log_path = os.path.join(trial_dir, 'trial.log')
+    argv = base_argv + ['--path', trial_dir, '--threads', str(threads)] + get_trial_flags(params)
+    with open(log_path, 'w') as log:
+        sys.stdout = sys.stderr = log
+        train.main(argv)
+        train.main(argv + ['--load'])
+
+    metrics = calculate_nav_metrics(read_nav_file(os.path.join(trial_dir, 'daily_nav.csv')))
+    row = {'trial': os.path.basename(trial_dir), **params, **metrics}
+    with open(os.path.join(trial_dir, 'metrics.json'), 'w') as f:
+        json.dump(row, f, indent=2, default=float)
+    return row
+
+
+def write_summary(out_dir: str, trial_names: list):
+    """Collect the metrics of all finished trials of the grid into summary.csv"""
+    rows = []
+    for name in trial_names:
+        metrics_path = os.path.join(out_dir, name, 'metrics.json')
+        if os.path.exists(metrics_path):
+            with open(metrics_path) as f:
+                rows.append(json.load(f))
+    summary_df = pd.DataFrame(rows)
+    if not summary_df.empty:
+        summary_df = summary_df.sort_values('Sharpe Ratio', ascending=False)
+    summary_df.to_csv(os.path.join(out_dir, 'summary.csv'), index=False)
+    return summary_df
+
+
+def run_sweep(grid: dict, choose_set_num: int, stocks: str, out_dir: str, predict=False, workers=None, threads=1,
+              rerun=False):
+    """Run every trial of the grid in a process pool, skipping trials that already have metrics"""
+    base_argv = ['--choose_set_num', str(choose_set_num), '--stocks', stocks] + (['--predict'] if predict else [])
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // max(threads, 1))
+
+    trials = get_trials(grid)
+    trial_names = [get_trial_name(params) for params in trials]
+    pending = []
+    for params, name in zip(trials, trial_names):
+        trial_dir = os.path.abspath(os.path.join(out_dir, name))
+        if not rerun and os.path.exists(os.path.join(trial_dir, 'metrics.json')):
+            print(f'Skipping finished trial {name}')
+            continue
+        Path(trial_dir).mkdir(parents=True, exist_ok=True)
+        with open(os.path.join(trial_dir, 'params.json'), 'w') as f:
+            json.dump(params, f, indent=2)
+        pending.append((params, trial_dir))
+    print(f'{len(pending)} of {len(trials)} trials to run with {workers} workers')
+
+    # One task per worker process, so every trial gets its own tensorflow runtime, graph and session
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as executor:
+        futures = {executor.submit(run_trial, base_argv, params, trial_dir, threads): trial_dir
+                   for params, trial_dir in pending}
+        for future in as_completed(futures):
+            name = os.path.basename(futures[future])
+            try:
+                row = future.result()
+                print(f'Finished trial {name}: Sharpe Ratio {row["Sharpe Ratio"]:.2f}, '
+                      f'Total Return {row["Total Return (%)"]:.2f}%')
+            except Exception as e:
+                # Failed trials have no metrics and are picked up again on the next run
+                print(f'Trial {name} failed: {e!r}, see {os.path.join(futures[future], "trial.log")}')
+
+    return write_summary(out_dir, trial_names)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--choose_set_num", required=True, type=int)
+    arg_parser.add_argument("--stocks", required=True)
+    arg_parser.add_argument("--out", required=True, help='Directory that holds one subdirectory per trial')
+    arg_parser.add_argument("--grid", required=True,
+                            help='JSON file or inline JSON of {parameter: [values]}, '
+                                 'e.g. {"price_period": [20, 30], "full_swing": [false, true]}')
+    arg_parser.add_argument("--predict", action='store_true', help='Sweep the LSTM forecast mode')
+    arg_parser.add_argument("--workers", type=int, default=None)
+    arg_parser.add_argument("--threads", type=int, default=1, help='Threads per trial')
+    arg_parser.add_argument("--rerun", action='store_true', help='Run finished trials again')
+    args = arg_parser.parse_args()
+
+    if os.path.exists(args.grid):
+        with open(args.grid) as f:
+            grid = json.load(f)
+    else:
+        grid = json.loads(args.grid)
+
+    summary_df = run_sweep(grid, args.choose_set_num, args.stocks, args.out, args.predict, args.workers,
+                           args.threads, args.rerun)
+    print(summary_df.to_string(index=False))
@@ -0,0 +1,253 @@
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tqdm import tqdm
+import util
+import rl
+
+# Settings of the two training modes, keyed by whether LSTM forecasts enter the state. The evaluation
+# compositions are those of three asset portfolios, others start from the ActionTable start composition
+MODE_DEFAULTS = {
+    False: {'price_period': 30, 'reward_period': 15, 'eval_composition': [0.1 + 0.3, 0.1 + 0.2, 0.1 + 0.2],
+            'total_steps': 1000},
+    True: {'price_period': 20, 'reward_period': 10, 'eval_composition': [0.1, 0.1, 0.1 + 0.7], 'total_steps': 0},
+}
+
+weight_decay_beta = float('10e-9')
+batch_size = 32
+buffer_size = 1000000
+update_freq = 10
+gamma = .99
+start_e = 1
+end_e = 0.1
+annealing_steps = 5000
+pre_train_steps = 84400  # 160000
+tau = 0.0005
+# Starting value of every asset
+start_asset = 100000
+
+save_rl_data = True
+save_passive = True
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--choose_set_num", required=True, help='Position or name of the portfolio in the registry')
+    arg_parser.add_argument("--stocks", required=True)
+    arg_parser.add_argument("--path", required=True)
+    arg_parser.add_argument("--predict", action='store_true', help='Add LSTM forecasts to the state')
+    arg_parser.add_argument("--load", action='store_true')
+    arg_parser.add_argument("--full_swing", action='store_true')
+    arg_parser.add_argument("--num_envs", type=int, default=1)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    # Mode dependent defaults are filled in from MODE_DEFAULTS
+    arg_parser.add_argument("--price_period", type=int, default=None)
+    arg_parser.add_argument("--reward_period", type=int, default=None)
+    arg_parser.add_argument("--h_size", type=int, default=100)
+    arg_parser.add_argument("--learning_rate", type=float, default=0.001)
+    arg_parser.add_argument("--num_episodes", type=int, default=350)
+    # Intra and inter op threads of tensorflow, eager and in the session, 0 lets tensorflow decide
+    arg_parser.add_argument("--threads", type=int, default=0)
+    arg_parser.add_argument("--state_cache", action='store_true')
+    arg_parser.add_argument("--tf2", action='store_true',
+                            help='Train eagerly with the compiled network instead of a graph and session')
+    arg_parser.add_argument("--xla", action='store_true', help='XLA compile the network functions, with --tf2')
+    return arg_parser
+
+
+def get_state_table(args, run_name: str, stocks: list, trend_list: list, price_panel) -> np.ndarray:
+    """States of every trend date, with the LSTM forecasts of the state assets in predict mode
+
+    The state assets are all assets but the last, lowest risk one.
+    """
+    state_cache_dir = f'data/rl/{run_name}/cache' if args.state_cache else None
+    state_assets = len(stocks) - 1
+    forecast_list = None
+    if args.predict:
+        forecast_list = [rl.get_forecast_table(f'data/rl/{run_name}/lstm/stock_pred_{stocks[i]}.hdf5',
+                                               trend_list, price_panel, i, args.price_period)
+                         for i in range(state_assets)]
+    return rl.get_state_table(trend_list, price_panel, args.price_period, state_assets=state_assets,
+                              forecast_list=forecast_list, cache_dir=state_cache_dir)
+
+
+def save_evaluation(portfolio_composition_list: list, price_panel, date_range: list, trend_list: list, stocks: list,
+                    path: str, run_name: str, start_assets: list):
+    """Writes the daily and quarterly NAV of the evaluated policy and of buy and hold of every asset"""
+    daily_df, daily_price_df = rl.get_daily_nav(price_panel, date_range, trend_list, portfolio_composition_list,
+                                                stocks, asset_list=start_assets)
+
+    # Generate passive NAV returns for comparison (buy and hold)
+    # assets are all 300000 to be able to compare to algo
+    passive_daily_df = rl.get_passive_daily_nav(price_panel, daily_df['Date'].tolist(), stocks,
+                                                initial_asset=sum(start_assets))
+
+    # Quarterly NAV returns of the policy and of every passive asset, for visualisation
+    quarterly_returns_df = util.cal_quarterly_returns(passive_daily_df.assign(Net=daily_df['Net']),
+                                                      ['Net'] + stocks)
+    quarterly_df = quarterly_returns_df[['start_period', 'end_period', 'Net']].rename(
+        columns={'Net': 'quarterly_return'})
+    passive_quarterly_df = quarterly_returns_df[['start_period', 'end_period'] + stocks]
+
+    # Print some quarterly difference statistics
+    for symbol in stocks:
+        difference = quarterly_df['quarterly_return'].values - passive_quarterly_df[symbol].values
+        print('Stock {} total return difference = {}'.format(symbol, sum(difference)))
+
+    for symbol in stocks:
+        symbol_cvar = abs(util.cvar_percent(passive_daily_df, len(passive_daily_df) - 1, len(passive_daily_df) - 1,
+                                            price_col=symbol))
+        print('Stock cvar {}: {}'.format(symbol, symbol_cvar))
+
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+    if save_passive:
+        passive_daily_df.to_csv(f'{path}/passive_daily_nav.csv')
+        passive_quarterly_df.to_csv(f'{path}/passive_quarterly_nav_return.csv')
+        print('Passive data saved for {}'.format(run_name))
+
+    if save_rl_data:
+        daily_df.to_csv(f'{path}/daily_nav.csv')
+        quarterly_df.to_csv(f'{path}/quarterly_nav_return.csv')
+        daily_price_df.to_csv(f'{path}/daily_price.csv')
+        print('Data saved for {}'.format(run_name))
+
+
+class TrainingRun():
+    """One train.py configuration with everything it needs outside the graph: dataset, state table and actions
+
+    datasets and state_tables are optional dicts shared between runs of one process, so that runs on the same
+    portfolio load its dataset and build its states once.
+    """
+    def __init__(self, argv=None, datasets=None, state_tables=None):
+        args = get_arg_parser().parse_args(argv)
+        self.mode_defaults = MODE_DEFAULTS[args.predict]
+        for name in ['price_period', 'reward_period']:
+            if getattr(args, name) is None:
+                setattr(args, name, self.mode_defaults[name])
+        self.args = args
+
+        self.run_name = util.get_portfolio(args.choose_set_num)['name']
+        self.stocks = args.stocks.split(',')
+        self.path = args.path.replace(',', '/')
+
+        datasets = {} if datasets is None else datasets
+        if self.run_name not in datasets:
+            datasets[self.run_name] = util.get_algo_dataset(args.choose_set_num)
+        df_list, self.date_range, self.trend_list, _, self.price_panel = datasets[self.run_name]
+        if len(self.stocks) != len(df_list):
+            raise ValueError(f'--stocks names {len(self.stocks)} assets but {self.run_name} has {len(df_list)}')
+        self.action_table = rl.ActionTable(len(self.stocks))
+        self.start_assets = [start_asset] * len(self.stocks)
+        self.eval_composition = self.mode_defaults['eval_composition']
+        if len(self.eval_composition) != len(self.stocks):
+            self.eval_composition = self.action_table.start_composition
+
+        # States only depend on the trend date, so they are computed once for all episodes
+        state_tables = {} if state_tables is None else state_tables
+        state_key = (self.run_name, args.stocks, args.predict, args.price_period)
+        if state_key not in state_tables:
+            state_tables[state_key] = get_state_table(args, self.run_name, self.stocks, self.trend_list,
+                                                      self.price_panel)
+        self.state_table = state_tables[state_key]
+        self.trainer = None
+        self.ep_10_reward = 0
+        self.nav_10_eps = 0
+
+    def build(self, scope=None):
+        """Builds the environment and the networks of the run, in the default graph inside scope if given
+
+        With --tf2 the networks are eager and scope is ignored.
+        """
+        args = self.args
+        env = rl.VecPortfolioEnv(self.price_panel, self.trend_list, self.state_table, num_envs=args.num_envs,
+                                 full_swing=args.full_swing, reward_period=args.reward_period,
+                                 action_table=self.action_table)
+        trainer_class, options = (rl.CompiledTrainer, {'jit_compile': args.xla}) if args.tf2 else (rl.Trainer, {})
+        self.trainer = trainer_class(env, args.h_size, self.state_table.shape[1], self.action_table.num_actions,
+                                     weight_decay_beta, args.learning_rate, batch_size, buffer_size, update_freq,
+                                     gamma, tau, start_e, end_e, annealing_steps, pre_train_steps,
+                                     self.mode_defaults['total_steps'], start_assets=self.start_assets,
+                                     seed=args.seed, scope=scope, **options)
+        # Make a path for model to be saved in.
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+
+    def log_episode_start(self, j: int):
+        trainer = self.trainer
+        print(f'Total Steps taken: {trainer.total_steps}')
+        if j % 10 == 0:
+            print(f"Episode {j}, Total Steps: {trainer.total_steps} Average Reward {self.ep_10_reward / 10}, "
+                  f"Average Nav {self.nav_10_eps / 10}")
+            print(f'exploration rate: {trainer.e_rate}')
+            self.ep_10_reward = 0
+            self.nav_10_eps = 0
+
+    def end_episode(self, sess, j: int, nav: float, ep_reward: float):
+        """Logs episode j and saves the model every 50 episodes from 200 onwards and after the last one"""
+        print(nav)
+        self.nav_10_eps += nav
+        self.ep_10_reward += ep_reward
+        print(f'Reward for episode: {ep_reward}')
+
+        if (j % 50 == 0 and j >= 200) or j == self.args.num_episodes - 1:
+            self.trainer.save(sess, self.path)
+            print("Saved model")
+
+    def evaluate(self, sess):
+        """Follows the greedy policy once through a one portfolio environment and writes the NAV files"""
+        env = rl.VecPortfolioEnv(self.price_panel, self.trend_list, self.state_table, full_swing=self.args.full_swing,
+                                 reward_period=self.args.reward_period, action_table=self.action_table)
+        portfolio_composition_list, nav = rl.evaluate_policy(sess, self.trainer, env, self.eval_composition,
+                                                             self.start_assets)
+        print(nav)
+        save_evaluation(portfolio_composition_list, self.price_panel, self.date_range, self.trend_list, self.stocks,
+                        self.path, self.run_name, self.start_assets)
+
+
+def get_session_config(threads: int):
+    """Intra and inter op threads of the session, 0 lets tensorflow decide"""
+    return tf.compat.v1.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)
+
+
+def train_or_evaluate(run: TrainingRun, sess=None):
+    """Trains the built run, or with --load evaluates its saved model. sess is None with --tf2"""
+    if run.args.load:
+        print('Loading model')
+        run.trainer.restore(sess, run.path)
+        run.evaluate(sess)
+        return
+
+    if sess is not None:
+        sess.run(tf.compat.v1.global_variables_initializer())
+    run.trainer.initialize(sess)
+    for j in tqdm(range(run.args.num_episodes)):
+        run.log_episode_start(j)
+        nav, ep_reward = run.trainer.run_episode(sess)
+        run.end_episode(sess, j, nav, ep_reward)
+
+
+def main(argv=None):
+    """Trains a model, or with --load evaluates a saved one and writes its NAV files"""
+    # Eager thread limits only take before tensorflow starts up, ahead of the forecasts and --tf2 runs
+    threads = get_arg_parser().parse_args(argv).threads
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    # The LSTM forecasts of the state table are made eagerly, only the networks of a graph run live in a graph
+    run = TrainingRun(argv)
+    if run.args.tf2:
+        run.build()
+        train_or_evaluate(run)
+        return
+
+    # Every run builds its networks in a graph of its own
+    with tf.Graph().as_default():
+        run.build()
+        with tf.compat.v1.Session(config=get_session_config(run.args.threads)) as sess:
+            train_or_evaluate(run, sess)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -5,13 +5,15 @@ import numpy as np
 import pandas as pd
 import math
 import sys
+import weakref
 
 def get_portfolio_comp(current_comp: list, df_list: list, base_rates: list, date: pd.Timestamp, 
     cvar_period=[10,10,10], mc_period=[10,10,10], sp_period=[10,10,10], c1=[0,0,0], c2=[0,0,0]):
-    """ df_list should contain ['High Risk', 'Medium Risk', 'Low Risk'] stocks in order
+    """ df_list should contain the stocks ordered from the highest to the lowest risk, e.g.
+    ['High Risk', 'Medium Risk', 'Low Risk']
     """
     stocks = df_list
-    sum_base_rates = base_rates[0] + base_rates[1] + base_rates[2]
+    sum_base_rates = sum(base_rates)
     # print("Total base rate = {:.2f}. Tactical rate = {:.2f}".format(sum_base_rates, 1-sum_base_rates))
     sum_factors = []
     for i, stock in enumerate(stocks):
@@ -37,28 +39,63 @@ def get_portfolio_comp(current_comp: list, df_list: list, base_rates: list, date
         norm_sum_factors.append(adjustable_comp*util.softmax(sum_factors)[i])
     return [base_rates[i] + norm_sum_factors[i] for i in range(len(base_rates))]
 
+def get_base_rate(num_assets: int) -> float:
+    """Default base rate of every asset, 0.1 as long as the base rates take up at most half of the portfolio
+    """
+    return min(0.1, 0.5 / num_assets)
+
+def get_portfolio_comps(current_comp: list, df_list: list, base_rates, dates: list,
+    cvar_period=[10,10,10], mc_period=[10,10,10], sp_period=[10,10,10], c1=[0,0,0], c2=[0,0,0]) -> np.ndarray:
+    """get_portfolio_comp of every date at once, each date starting from the composition of the date before
+
+    base_rates holds one base rate per asset, or a row of them per date. The indicator values come from the
+    cached rolling series. Returns a (len(dates), assets) array.
+    """
+    num_assets = len(df_list)
+    base_rates = np.broadcast_to(np.asarray(base_rates, dtype=float).reshape(-1, num_assets), (len(dates), num_assets))
+    t_list = []
+    for df in df_list:
+        date_labels = _get_date_labels(df)
+        t_list.append(np.array([date_labels.get(date, -1) for date in dates], dtype=np.int64))
+    # If any index does not operate on that date, skip reallocation. Percentile need 2 numbers or more, 0 is always nan
+    valid = np.logical_and.reduce([t > 1 for t in t_list]) if t_list else np.ones(len(dates), dtype=bool)
+
+    sum_factors = np.empty((np.count_nonzero(valid), num_assets))
+    for i, stock in enumerate(df_list):
+        t = t_list[i][valid]
+        sp = rolling_sp(stock, int(sp_period[i]))[t]
+        mr = np.abs(rolling_cvar_percent(stock, int(cvar_period[i]))[t] + c2[i])
+        mc = rolling_mc(stock, int(mc_period[i]))[t] + c1[i]
+        # modified_tanh uses math.exp, which np.exp does not match to the last bit
+        sum_factors[:, i] = np.array([util.modified_tanh(x) for x in (mr * mc).tolist()]) * sp
+
+    # Softmax with the denominator summed in asset order, as util.softmax does
+    exp_factors = np.exp(sum_factors)
+    exp_sums = np.zeros(len(exp_factors))
+    sum_base_rates = np.zeros(len(exp_factors))
+    for i in range(num_assets):
+        exp_sums = exp_sums + exp_factors[:, i]
+        sum_base_rates = sum_base_rates + base_rates[valid, i]
+    adjustable_comp = 1 - sum_base_rates
+    comps = np.empty((len(dates) + 1, num_assets))
+    comps[0] = current_comp
+    comps[1:][valid] = base_rates[valid] + adjustable_comp[:, np.newaxis] * (exp_factors / exp_sums[:, np.newaxis])
+    # Skipped dates keep the composition of the date before
+    source_rows = np.maximum.accumulate(np.where(valid, np.arange(1, len(dates) + 1), 0))
+    return comps[source_rows]
+
 def f_mr(df: pd.DataFrame, t: int, period=10, alpha=0.95, c2=0, price_col='Close'):
-	return abs(cvar_percent(df, t, period, alpha, price_col) + c2)
+	return abs(rolling_cvar_percent(df, period, alpha, price_col)[t] + c2)
 
 def f_mc(df, t: int, period=10, c1=0):
-	mc_df = indicators.macd_line(df, center=False) - indicators.macd_signal(df, center=False)
-	if t-period+1 < 0:
-		norm_array_df = mc_df.iloc[0:t+1]
-	else:
-		norm_array_df = mc_df.iloc[t-period+1:t+1]
-	norm_mc = util.z_score_normalization(norm_array_df.values[-1], norm_array_df.values.tolist())
+	norm_mc = rolling_mc(df, period)[t]
 	# print("Market Condition = {:.2f}".format(norm_mc))
 	return norm_mc + c1
 
 def f_sp(df:pd.DataFrame, t: int, period=10):
     # mean_ema = ema_df.iloc[t-period+1:t+1].mean()
     # print("Swing Potential = {:.2f}".format(mean_ema))
-    # t must be bigger than 2 to normalize
-    ema_df = indicators.exponential_moving_avg(df, window_size=period, center=False)
-    if t-period+2 < 0:
-        return util.z_score_normalization(ema_df.iloc[t] ,ema_df.iloc[0:t+1])
-    else:
-        return util.z_score_normalization(ema_df.iloc[t] ,ema_df.iloc[t-period+1:t+1])
+    return rolling_sp(df, period)[t]
     # return mean_ema
 
 def value_at_risk_percent(df: pd.DataFrame, t: int, period=10, alpha=0.95, price_col='Close'):
@@ -85,3 +122,115 @@ def cvar_percent(df: pd.DataFrame, t: int, period=10, alpha=0.95, price_col='Clo
         return 0
     lower_than_threshold_returns = [returns for returns in returns_list if returns < var_percent]
     return np.nanmean(lower_than_threshold_returns)
+
+# Arrays derived from a DataFrame, keyed by id(df) and dropped once the DataFrame is garbage collected
+_df_caches = {}
+
+def get_df_cache(df: pd.DataFrame) -> dict:
+    """Dict for values derived from df that live as long as df. df must not be modified afterwards
+    """
+    key = id(df)
+    if key not in _df_caches:
+        _df_caches[key] = {}
+        weakref.finalize(df, _df_caches.pop, key, None)
+    return _df_caches[key]
+
+def rolling_var_cvar_percent(df: pd.DataFrame, period=10, alpha=0.95, price_col='Close') -> tuple:
+    """VaR and CVaR percent of every t at once, equal to value_at_risk_percent and cvar_percent at each t
+
+    Computed in one pass over a sliding window view of the returns and cached per (df, period, alpha,
+    price_col). Returns (var array, cvar array) indexed by t.
+    """
+    cache = get_df_cache(df)
+    key = ('var_cvar', period, alpha, price_col)
+    if key not in cache:
+        if price_col=='Close':
+            returns = df['returns'].to_numpy(dtype=float)
+        else:
+            returns = indicators.day_gain(df, price_col).to_numpy(dtype=float)
+        df_length = len(returns)
+        t = np.arange(df_length)
+        # Window rows as sliced by value_at_risk_percent, t must be bigger than 2 to evaluate percentile
+        start = np.where(t-period+2 < 0, 1, t-period+1)
+        # iloc with a start of -1 counts from the end of the DataFrame
+        start = np.where(start < 0, start + df_length, start)
+        if price_col!='Close':
+            # Gains computed inside the window have no value for its first row
+            start = start + 1
+        cache[key] = util.window_var_cvar(_get_windows(returns, start, t + 1), alpha)
+    return cache[key]
+
+def rolling_cvar_percent(df: pd.DataFrame, period=10, alpha=0.95, price_col='Close') -> np.ndarray:
+    """cvar_percent of every t, see rolling_var_cvar_percent
+    """
+    return rolling_var_cvar_percent(df, period, alpha, price_col)[1]
+
+def cached_cvar_percent(df: pd.DataFrame, t: int, period=10, alpha=0.95, price_col='Close') -> float:
+    """cvar_percent memoized per df, for single lookups such as the CVaR over the whole history
+    """
+    cache = get_df_cache(df)
+    key = ('cvar', t, period, alpha, price_col)
+    if key not in cache:
+        cache[key] = cvar_percent(df, t, period, alpha, price_col)
+    return cache[key]
+
+def get_indicator_series(df: pd.DataFrame, name: str, window_size=None) -> np.ndarray:
+    """Trailing (center=False) indicator series of df, computed once per (df, name, window_size)
+
+    name is 'ema' with window_size, or 'macd_histogram' (MACD line minus MACD signal).
+    """
+    cache = get_df_cache(df)
+    key = ('indicator', name, window_size)
+    if key not in cache:
+        if name == 'ema':
+            series = indicators.exponential_moving_avg(df, window_size=window_size, center=False)
+        elif name == 'macd_histogram':
+            series = indicators.macd_line(df, center=False) - indicators.macd_signal(df, center=False)
+        else:
+            raise ValueError(f'Unknown indicator {name}')
+        cache[key] = series.to_numpy(dtype=float)
+    return cache[key]
+
+def rolling_mc(df: pd.DataFrame, period=10) -> np.ndarray:
+    """Market condition of every t without c1, f_mc(df, t, period) - c1 at each t
+    """
+    cache = get_df_cache(df)
+    key = ('mc', period)
+    if key not in cache:
+        mc = get_indicator_series(df, 'macd_histogram')
+        t = np.arange(len(mc))
+        start = np.maximum(t-period+1, 0)
+        cache[key] = util.window_z_score(mc, _get_windows(mc, start, t + 1))
+    return cache[key]
+
+def rolling_sp(df: pd.DataFrame, period=10) -> np.ndarray:
+    """Swing potential of every t, f_sp(df, t, period) at each t
+    """
+    cache = get_df_cache(df)
+    key = ('sp', period)
+    if key not in cache:
+        ema = get_indicator_series(df, 'ema', period)
+        t = np.arange(len(ema))
+        # t must be bigger than 2 to normalize
+        start = np.where(t-period+2 < 0, 0, t-period+1)
+        # iloc with a start of -1 counts from the end of the series
+        start = np.where(start < 0, start + len(ema), start)
+        cache[key] = util.window_z_score(ema, _get_windows(ema, start, t + 1))
+    return cache[key]
+
+def _get_windows(values: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """2D array whose row i holds values[start[i]:end[i]], padded with nan to the longest window
+    """
+    width = max(int((end - start).max()), 1) if len(start) else 1
+    padded = np.concatenate([values, np.full(width, np.nan)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width)[np.minimum(start, len(values))]
+    return np.where(np.arange(width) < (end - start)[:, np.newaxis], windows, np.nan)
+
+def _get_date_labels(df: pd.DataFrame) -> dict:
+    """Index label of the first row of every date in df, cached per df
+    """
+    cache = get_df_cache(df)
+    if 'date_labels' not in cache:
+        # Reversed so that the first row of a duplicated date is written last
+        cache['date_labels'] = dict(zip(df['Date'].iloc[::-1], df.index[::-1]))
+    return cache['date_labels']
@@ -4,69 +4,268 @@ import indicators
 import config
 import util
 import sys
+import os
+import json
+import hashlib
+import contextlib
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-def get_algo_dataset(choose_set_num: int):
-    """ Returns df_list, date_range, trend_list, stocks
+portfolio_registry_path = 'data/rl/portfolios.json'
+_portfolio_registry = {}
+
+def get_portfolio_registry(path=portfolio_registry_path) -> list:
+    """Portfolio descriptions of the registry at path, read on first use
+
+    Each portfolio has a name, its assets as {"symbol", "file"} ordered from the highest to the lowest risk,
+    and the trend_start and trend_end dates of the trend window. Asset files are read from "dir", which
+    defaults to data/rl/<name>.
+    """
+    if path not in _portfolio_registry:
+        with open(path) as f:
+            _portfolio_registry[path] = json.load(f)['portfolios']
+    return _portfolio_registry[path]
+
+def get_portfolio(portfolio, path=portfolio_registry_path) -> dict:
+    """Registry entry of a portfolio, by its position in the registry or by name"""
+    registry = get_portfolio_registry(path)
+    if isinstance(portfolio, str) and not portfolio.isdigit():
+        for entry in registry:
+            if entry['name'] == portfolio:
+                return entry
+        raise KeyError(f'Unknown portfolio {portfolio}, the registry {path} has '
+                       f'{[entry["name"] for entry in registry]}')
+    return registry[int(portfolio)]
+
+def get_algo_dataset(choose_set_num, cache=True):
+    """ Returns df_list, date_range, trend_list, stocks, price_panel
+
+    choose_set_num is the position or name of the portfolio in the registry. With cache the cleaned dataset
+    is read from, or written to, a binary cache, see load_portfolio
     """
-    # Do not change run_set order. The order is hardcoded into below code
-    run_set = ['portfolio1', 'portfolio2','portfolio3']
-    choose_set = run_set[choose_set_num]
-    df_list = []
-    date_range = []
-    trend_list = []
-    stocks = []
-
-    if choose_set == run_set[0]:
-        stocks =['AUD','CAD','USD']
-        for stock in stocks:
-            df=pd.read_csv(f'data/rl/portfolio1/{stock}.csv', parse_dates=['Date'])
-            df = df[df['Close'] > 0].reset_index(drop=True)
-            df['returns'] = indicators.day_gain(df, 'Close').dropna()
-            df_list.append(df)
-
-        start = '1/1/2021'
-        end = '31/12/2023'
-        date_range = remove_uncommon_dates(df_list)
-        trend_list = util.get_trend_list(stocks, df_list, start=start, end=end)
-
-    elif choose_set == run_set[1]:
-        stocks =['USD','CNY','INR']
-        for stock in stocks:
-            df=pd.read_csv(f'data/rl/portfolio2/{stock}.csv', parse_dates=['Date'])
-            df = df[df['Close'] > 0].reset_index(drop=True)
-            df['returns'] = indicators.day_gain(df, 'Close').dropna()
-            df_list.append(df)
-
-        start = '1/1/2021'
-        end = '31/12/2023'
-        date_range = remove_uncommon_dates(df_list)
-        trend_list = util.get_trend_list(stocks, df_list, start=start, end=end)
-
-    elif choose_set == run_set[2]:
-        stocks =['Govt','ESG','Shariah']
-        for stock in stocks:
-            df=pd.read_csv(f'data/rl/portfolio3/{stock}.csv', parse_dates=['Date'])
-            df = df[df['Close'] > 0].reset_index(drop=True)
-            df['returns'] = indicators.day_gain(df, 'Close').dropna()
-            df_list.append(df)
-
-        start = '1/1/2021'
-        end = '31/12/2023'
-        date_range = remove_uncommon_dates(df_list)
-        trend_list = util.get_trend_list(stocks, df_list, start=start, end=end)
-        
-    return df_list, date_range, trend_list, stocks
+    portfolio = get_portfolio(choose_set_num)
+    portfolio_dir = portfolio.get('dir', f'data/rl/{portfolio["name"]}')
+    stocks = [asset['symbol'] for asset in portfolio['assets']]
+    source_paths = [f'{portfolio_dir}/{asset["file"]}' for asset in portfolio['assets']]
+    df_list, date_range, trend_list, trend_positions = load_portfolio(
+        source_paths, stocks, portfolio['trend_start'], portfolio['trend_end'],
+        cache_dir=f'{portfolio_dir}/cache' if cache else None)
+    price_panel = PricePanel(df_list, date_range, trend_positions=trend_positions)
+    return df_list, date_range, trend_list, stocks, price_panel
+
+
+def get_algo_datasets(portfolios=None, cache=True, workers=None) -> dict:
+    """get_algo_dataset of several portfolios, all of the registry by default, loaded in a process pool
+
+    Returns {portfolio: dataset}.
+    """
+    if portfolios is None:
+        portfolios = [entry['name'] for entry in get_portfolio_registry()]
+    portfolios = list(portfolios)
+    if workers == 1 or len(portfolios) <= 1:
+        return {portfolio: get_algo_dataset(portfolio, cache) for portfolio in portfolios}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        datasets = executor.map(get_algo_dataset, portfolios, [cache] * len(portfolios))
+        return dict(zip(portfolios, datasets))
+
+
+def read_asset_csv(path: str) -> pd.DataFrame:
+    """Daily prices of one asset with non positive closes removed and a 'returns' column of percent day gains
+    """
+    df=pd.read_csv(path, parse_dates=['Date'])
+    df = df[df['Close'] > 0].reset_index(drop=True)
+    df['returns'] = indicators.day_gain(df, 'Close').dropna()
+    return df
+
+
+# Bump when read_asset_csv or util.get_trend_list change what a cached dataset holds
+dataset_cache_version = 1
+
+def load_portfolio(source_paths: list, stocks: list, start, end, cache_dir=None) -> tuple:
+    """Returns df_list, date_range, trend_list, trend_positions of the asset CSVs in source_paths
+
+    With cache_dir the cleaned frames, date_range and the trend dates are kept there as .npy files, one per
+    column, that later runs memory map instead of parsing the CSVs and recomputing the trends. A cache is
+    used while every source file has the modification time and size it was built from, or failing that
+    the same SHA1, and is rebuilt otherwise.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha1(json.dumps([dataset_cache_version, source_paths, stocks, start, end]).encode())
+        cache_path = Path(cache_dir) / f'dataset_{digest.hexdigest()[:16]}'
+        dataset = _read_dataset_cache(cache_path, source_paths)
+        if dataset is not None:
+            return dataset
+
+    df_list = [read_asset_csv(path) for path in source_paths]
+    date_range = remove_uncommon_dates(df_list)
+    trend_list, trend_positions = util.get_trend_list(stocks, df_list, start=start, end=end, date_range=date_range)
+    dataset = (df_list, date_range, trend_list, trend_positions)
+    # Columns numpy can only store as pickled objects are not cached
+    if cache_path is not None and all(dtype != object for df in df_list for dtype in df.dtypes):
+        _write_dataset_cache(cache_path, source_paths, dataset)
+    return dataset
+
+
+def _get_source_stats(path: str) -> dict:
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _get_source_sha1(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _read_dataset_cache(cache_path: Path, source_paths: list):
+    manifest_path = cache_path / 'manifest.json'
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    touched = False
+    for path, source in zip(source_paths, manifest['sources']):
+        if _get_source_stats(path) != source['stats']:
+            # Touched but unchanged files keep the cache, with their new stats recorded
+            if _get_source_sha1(path) != source['sha1']:
+                return None
+            source['stats'] = _get_source_stats(path)
+            touched = True
+    if touched:
+        _write_json(manifest_path, manifest)
+
+    def load(name):
+        return np.load(cache_path / f'{name}.npy', mmap_mode='r')
+
+    df_list = [pd.DataFrame({column: load(f'{i}_{k}') for k, column in enumerate(columns)})
+               for i, columns in enumerate(manifest['columns'])]
+    date_range = pd.DatetimeIndex(load('date_range')).tolist()
+    trend_list = pd.DatetimeIndex(load('trend_list')).tolist()
+    return df_list, date_range, trend_list, np.array(load('trend_positions'))
+
+
+def _write_dataset_cache(cache_path: Path, source_paths: list, dataset: tuple):
+    df_list, date_range, trend_list, trend_positions = dataset
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # The cache is written into a directory of this process and renamed into place, so other processes
+    # never map a file that is still being written
+    tmp_path = Path(tempfile.mkdtemp(prefix=f'{cache_path.name}.', suffix='.tmp', dir=cache_path.parent))
+    try:
+        for i, df in enumerate(df_list):
+            for k, column in enumerate(df.columns):
+                np.save(tmp_path / f'{i}_{k}.npy', df[column].to_numpy())
+        np.save(tmp_path / 'date_range.npy', pd.DatetimeIndex(date_range).values)
+        np.save(tmp_path / 'trend_list.npy', pd.DatetimeIndex(trend_list).values)
+        np.save(tmp_path / 'trend_positions.npy', np.asarray(trend_positions))
+        manifest = {'sources': [{'path': path, 'stats': _get_source_stats(path), 'sha1': _get_source_sha1(path)}
+                                for path in source_paths],
+                    'columns': [df.columns.tolist() for df in df_list]}
+        _write_json(tmp_path / 'manifest.json', manifest)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # A stale cache, or one another process has just written, is moved aside first. Its files
+            # stay valid for the processes that have them mapped
+            stale_path = tmp_path.with_name(tmp_path.name + '.stale')
+            try:
+                os.replace(cache_path, stale_path)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                # Another process got its complete cache in place in between
+                pass
+            shutil.rmtree(stale_path, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _write_json(path: Path, data: dict):
+    with _atomic_file(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def save_array(path, array: np.ndarray):
+    """np.save to path through a temporary file of this process, so concurrent readers only see complete files"""
+    with _atomic_file(path, 'wb') as f:
+        np.save(f, array)
+
+
+@contextlib.contextmanager
+def _atomic_file(path, mode: str):
+    """Opens a temporary file next to path, renamed to path when the block completes and removed otherwise"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'{path.name}.', suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 
 def remove_uncommon_dates(df_list):
-    date_range = []
-    for date in df_list[0]['Date']:
-        empty = 0
-        for df in df_list:
-            temp_df = df[df['Date'] == date]
-            if temp_df.empty:
-                empty +=1
-        if empty == 0:
-            date_range.append(date)
-    return date_range
+    """Returns the dates of df_list[0], in their original order, that every DataFrame in df_list contains
+    """
+    # A date common to all assets appears once in each de-duplicated date array
+    unique_dates = [np.unique(df['Date'].values) for df in df_list]
+    all_dates, counts = np.unique(np.concatenate(unique_dates), return_counts=True)
+    common_dates = all_dates[counts == len(df_list)]
+    dates = df_list[0]['Date']
+    return dates[dates.isin(common_dates)].tolist()
+
+
+class PricePanel():
+    """Close prices of every asset aligned on date_range
+
+    prices[row, asset] holds the price of df_list[asset] on date_range[row] and
+    date_index maps a date to its row, so a lookup is a dict access and an array read
+    instead of a boolean scan of the DataFrame. trend_positions are the rows of the
+    trend dates, as returned by util.get_trend_list, and is_trend flags those rows.
+    """
+    def __init__(self, df_list: list, date_range: list, price_col='Close', trend_positions=None):
+        self.dates = list(date_range)
+        self.date_index = {}
+        for row, date in enumerate(self.dates):
+            # First row wins on duplicated dates
+            self.date_index.setdefault(date, row)
+        self.trend_positions = None if trend_positions is None else np.asarray(trend_positions)
+        self.is_trend = np.zeros(len(self.dates), dtype=bool)
+        if self.trend_positions is not None:
+            self.is_trend[self.trend_positions] = True
+        self.prices = np.empty((len(self.dates), len(df_list)))
+        for i, df in enumerate(df_list):
+            # First row wins on duplicated dates, as with df[df['Date'] == date].values[0]
+            price_series = df.drop_duplicates('Date').set_index('Date')[price_col]
+            self.prices[:, i] = price_series.reindex(self.dates).values
+
+    def get_rows(self, dates: list) -> np.ndarray:
+        """Rows of dates"""
+        return np.array([self.date_index[date] for date in dates], dtype=np.int64)
+
+    def get_trend_rows(self, trend_list: list) -> np.ndarray:
+        """Rows of trend_list, read from trend_positions when the panel was built with them
+
+        trend_list must then be the trend dates those positions came from.
+        """
+        if self.trend_positions is None:
+            return self.get_rows(trend_list)
+        if len(trend_list) != len(self.trend_positions):
+            raise ValueError(f'{len(trend_list)} trend dates given but the panel has {len(self.trend_positions)}')
+        return self.trend_positions
+
+    def get_date_mask(self, dates: list) -> np.ndarray:
+        """Boolean array over the rows, True on the rows of dates"""
+        mask = np.zeros(len(self.dates), dtype=bool)
+        mask[self.get_rows(dates)] = True
+        return mask
+
+    def get_prices(self, date) -> np.ndarray:
+        """Prices of all assets on date"""
+        return self.prices[self.date_index[date]]
+
+    def get_price(self, i: int, date) -> float:
+        """Price of asset i on date"""
+        return self.prices[self.date_index[date], i]
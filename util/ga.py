@@ -1,11 +1,17 @@
 import indicators
 import util
+import numpy as np
 import pandas as pd
 import math
-import calendar
 from copy import deepcopy
 
-def get_trend_list(stocks:list, df_list: list, start='1/1/2021', end='31/12/2023'):
+def get_trend_list(stocks:list, df_list: list, start='1/1/2021', end='31/12/2023', date_range=None) -> tuple:
+    """Returns (trend_list, trend_positions)
+
+    trend_list holds the sorted start and end dates of every MACD buy and sell period of every asset that
+    all assets trade on, trend_positions the position of each of those dates in date_range. date_range
+    defaults to the dates common to all of df_list.
+    """
     select_indicators = ['MACD Line']
     action_periods_dict = {}
 
@@ -20,74 +26,93 @@ def get_trend_list(stocks:list, df_list: list, start='1/1/2021', end='31/12/2023
 
         # util.plot_market_trends(df, indicator_dict, stock)
         action_periods_dict[stock] = indicator_dict
-    buy_trend_set = set()
-    sell_trend_set = set()
+
+    # Join buy and sell periods together, treating each start and end period as a period of action
+    trend_dates = []
     for i,symbol in enumerate(action_periods_dict):
-        df = df_list[i]
-        for period in action_periods_dict[symbol]['MACD Line']['buy_periods']:
-            buy_trend_set.add(df['Date'].iloc[period[0]])
-            buy_trend_set.add(df['Date'].iloc[period[1]])
-        for period in action_periods_dict[symbol]['MACD Line']['sell_periods']:
-            sell_trend_set.add(df['Date'].iloc[period[0]])
-            sell_trend_set.add(df['Date'].iloc[period[1]])
-
-    # Join 2 sets together, treating each start and end period as a period of action
-    trend_list = list(buy_trend_set.union(sell_trend_set))
-    temp_trend_list = []
-    for date in trend_list:
-        df1 = df_list[0][df_list[0]['Date'] == date]
-        df2 = df_list[1][df_list[1]['Date'] == date]
-        df3 = df_list[2][df_list[2]['Date'] == date]
-        if not (df1.empty or df2.empty or df3.empty):
-            temp_trend_list.append(date)
-    trend_list = sorted(temp_trend_list)
-    return trend_list
-
-def cal_portfolio_comp_fitness(asset_list, base_rates, original_portfolio_comp, df_list, date_range, trend_list, cvar_period, mc_period, sp_period, c1, c2, thres, fitness=[]):
+        dates = df_list[i]['Date'].values
+        for periods in [action_periods_dict[symbol]['MACD Line']['buy_periods'],
+                        action_periods_dict[symbol]['MACD Line']['sell_periods']]:
+            trend_dates.append(dates[np.array(periods, dtype=np.int64).reshape(-1)])
+    trend_dates = np.unique(np.concatenate(trend_dates))
+
+    # Keep the dates every asset trades on
+    if date_range is None:
+        date_range = util.remove_uncommon_dates(df_list)
+    range_dates = pd.DatetimeIndex(date_range).values
+    trend_dates = trend_dates[np.isin(trend_dates, range_dates)]
+    # Sorted lookup of each trend date in date_range, the first row wins on duplicated dates
+    order = np.argsort(range_dates, kind='stable')
+    trend_positions = order[np.searchsorted(range_dates[order], trend_dates)]
+    return pd.DatetimeIndex(trend_dates).tolist(), trend_positions
+
+def cal_portfolio_comp_fitness(asset_list, base_rates, original_portfolio_comp, df_list, date_range, trend_list, cvar_period, mc_period, sp_period, c1, c2, thres, fitness=[], price_panel=None, commisson_rate=1.0/800):
     """Calculates the portfolio comp at each change and updates fitness values. Returns a boolean changes list
+
+    The compositions of all trend dates come from one util.get_portfolio_comps call and the threshold test
+    is done over arrays, so only the trades are stepped through with the arithmetic of cal_nav.
     """
-    change_list = []
-    i = 0
-    new_portfolio_comp = deepcopy(original_portfolio_comp)
-    last_trade_date=[date_range[0]]
-    for date in date_range:
-        high_risk_date = df_list[0][df_list[0]['Date'] == date]
-        med_risk_date = df_list[1][df_list[1]['Date'] == date]
-        low_risk_date = df_list[2][df_list[2]['Date'] == date]
-        if not (high_risk_date.empty or med_risk_date.empty or low_risk_date.empty):
-            if date in trend_list:
-                # print('Reallocating at {}'.format(date))
-                # Hack for multiple base rates
-                if len(base_rates) == 3:
-                    new_portfolio_comp = util.get_portfolio_comp(original_portfolio_comp, df_list, base_rates, date,
-                        cvar_period, mc_period, sp_period, c1, c2)
+    if price_panel is None:
+        price_panel = util.PricePanel(df_list, date_range)
+    dates = pd.Index(date_range)
+    # Dates every asset trades on, and the trend dates among them
+    present = np.logical_and.reduce([dates.isin(df['Date']) for df in df_list])
+    rebalance = present & dates.isin(trend_list)
+    rebalance_dates = [date_range[row] for row in np.flatnonzero(rebalance)]
+    # Hack for multiple base rates, a row of base rates per trend date
+    comp_base_rates = base_rates if np.ndim(base_rates) == 1 else base_rates[:len(rebalance_dates)]
+    comps = util.get_portfolio_comps(original_portfolio_comp, df_list, comp_base_rates, rebalance_dates,
+        cvar_period, mc_period, sp_period, c1, c2)
+
+    # Every reallocation trades without commission, or with commission when the composition moves more than thres
+    previous_comps = np.vstack([np.asarray(original_portfolio_comp, dtype=float).reshape(1, -1), comps[:-1]])
+    total_change = np.zeros(len(comps))
+    for i in range(comps.shape[1]):
+        total_change = total_change + np.abs(comps[:, i] - previous_comps[:, i])
+    trade = np.ones(len(comps), dtype=bool) if thres == 0 else total_change > thres
+
+    trade_dates = [date for date, traded in zip(rebalance_dates, trade) if traded]
+    trade_prices = price_panel.prices[price_panel.get_rows([date_range[0]] + trade_dates)].tolist()
+    trade_comps = comps[trade].tolist()
+    changes = {}
+    for k, date in enumerate(trade_dates):
+        previous_close_prices, current_close_prices = trade_prices[k], trade_prices[k+1]
+        new_portfolio_comp = trade_comps[k]
+        for i in range(len(new_portfolio_comp)):
+            # Update asset values
+            asset_list[i] = asset_list[i] * current_close_prices[i] / previous_close_prices[i]
+        if thres == 0:
+            for i, composition in enumerate(new_portfolio_comp):
+                asset_list[i] = sum(asset_list) * composition
+        else:
+            total_assets = sum(asset_list)
+            for i in range(len(new_portfolio_comp)):
+                amount_change = new_portfolio_comp[i] * total_assets - asset_list[i]
+                if amount_change <= 0:
+                    asset_list[i] = asset_list[i] + amount_change
                 else:
-                    new_portfolio_comp = util.get_portfolio_comp(original_portfolio_comp, df_list, base_rates[i], date,
-                        cvar_period, mc_period, sp_period, c1, c2)
-                    i += 1
-    # With commission
-                change = cal_nav(date, new_portfolio_comp, df_list, asset_list, last_trade_date, 
-                    original_portfolio_comp=original_portfolio_comp, thres=thres)
-    # # Without commission
-    #             change = cal_nav(date, new_portfolio_comp, df_list, asset_list, last_trade_date)
-    # #########################
-                original_portfolio_comp = new_portfolio_comp
-                change_list.append(change)
-            else:
-                change_list.append((False, 0, date))
-    asset_list = cal_fitness_with_nav(df_list, asset_list, last_trade_date[-1], date_range[-1], fitness)
-    return change_list, asset_list, [original_portfolio_comp[0], original_portfolio_comp[1], original_portfolio_comp[2]]
-
-def cal_nav(date, new_portfolio_comp, df_list, asset_list, last_trade_date: list, original_portfolio_comp=[], thres=0, commisson_rate=1.0/800):
+                    asset_list[i] = asset_list[i] + amount_change * (1 - commisson_rate)**2
+        changes[date] = (True, list(asset_list), date)
+
+    change_list = [changes.get(date, (False, 0, date)) for date in
+                   (date_range[row] for row in np.flatnonzero(present))]
+    last_trade_date = trade_dates[-1] if trade_dates else date_range[0]
+    asset_list = cal_fitness_with_nav(df_list, asset_list, last_trade_date, date_range[-1], fitness, price_panel=price_panel)
+    final_comp = comps[-1].tolist() if len(comps) else list(original_portfolio_comp)
+    return change_list, asset_list, final_comp
+
+def cal_nav(date, new_portfolio_comp, df_list, asset_list, last_trade_date: list, original_portfolio_comp=[], thres=0, commisson_rate=1.0/800, price_panel=None):
     """Updates asset list with calculated new assets. Returns change_list of (True, asset_list, date) or (False, 0, date)
     """
+    if price_panel is None:
+        price_panel = util.PricePanel(df_list, [last_trade_date[-1], date])
+    previous_close_prices = price_panel.get_prices(last_trade_date[-1])
+    current_close_prices = price_panel.get_prices(date)
     # without commission
     if thres == 0:
         for i in range(len(new_portfolio_comp)):
             # Update asset values
-            previous_close_price = df_list[i][df_list[i]['Date'] == last_trade_date[-1]]['Close'].values[0]
-            current_close_price = df_list[i][df_list[i]['Date'] == date]['Close'].values[0]
-            asset_list[i] = asset_list[i] * current_close_price / previous_close_price
+            asset_list[i] = asset_list[i] * current_close_prices[i] / previous_close_prices[i]
         for i, composition in enumerate(new_portfolio_comp):
             asset_list[i] = sum(asset_list) * composition
         last_trade_date.append(date)
@@ -105,9 +130,7 @@ def cal_nav(date, new_portfolio_comp, df_list, asset_list, last_trade_date: list
             # print('Portfolio nav changed from {}'.format(asset_list))
             for i in range(len(new_portfolio_comp)):
                 # Update asset values
-                previous_close_price = df_list[i][df_list[i]['Date'] == last_trade_date[-1]]['Close'].values[0]
-                current_close_price = df_list[i][df_list[i]['Date'] == date]['Close'].values[0]
-                asset_list[i] = asset_list[i] * current_close_price / previous_close_price
+                asset_list[i] = asset_list[i] * current_close_prices[i] / previous_close_prices[i]
 
             total_assets = sum(asset_list)
             for i in range(len(new_portfolio_comp)):
@@ -122,20 +145,22 @@ def cal_nav(date, new_portfolio_comp, df_list, asset_list, last_trade_date: list
             return (True, new_asset_list, date)
     return (False, 0, date)
 
-def cal_fitness_with_nav(df_list, asset_list, last_trade_date, last_date, fitness=[]):
+def cal_fitness_with_nav(df_list, asset_list, last_trade_date, last_date, fitness=[], price_panel=None):
     """Update final asset value and update fitness value if provided
     """
+    if price_panel is None:
+        price_panel = util.PricePanel(df_list, [last_trade_date, last_date])
+    previous_close_prices = price_panel.get_prices(last_trade_date)
+    current_close_prices = price_panel.get_prices(last_date)
     cvar = 0
     tmp_asset_list = deepcopy(asset_list)
     for i in range(len(df_list)):
-        previous_close_price = df_list[i][df_list[i]['Date'] == last_trade_date]['Close'].values[0]
-        current_close_price = df_list[i][df_list[i]['Date'] == last_date]['Close'].values[0]
-        tmp_asset_list[i] = tmp_asset_list[i] * current_close_price / previous_close_price
+        tmp_asset_list[i] = tmp_asset_list[i] * current_close_prices[i] / previous_close_prices[i]
     asset_value = sum(tmp_asset_list)
     # print('Portfolio asset value = {}'.format(asset_value))
     for i in range(len(df_list)):
         composition =  tmp_asset_list[i]/asset_value
-        cvar_value = util.cvar_percent(df_list[i], len(df_list[i])-1, len(df_list[i])-1) * composition
+        cvar_value = util.cached_cvar_percent(df_list[i], len(df_list[i])-1, len(df_list[i])-1) * composition
         cvar += abs(cvar_value)
     # print('Final cvar: {}'.format(cvar))
     fitness_value = asset_value / cvar
@@ -145,25 +170,50 @@ def cal_fitness_with_nav(df_list, asset_list, last_trade_date, last_date, fitnes
     return tmp_asset_list
     # print('Number of trades done = {}'.format(len(last_trade_date)))
 
+def cal_quarterly_returns(daily_df: pd.DataFrame, price_cols: list) -> pd.DataFrame:
+    """Calendar quarter returns of every column in price_cols, in one frame with a column per price column
+
+    A column's return runs from its first to its last non zero value in the quarter. Quarters where a column
+    has two or fewer such values are nan for that column, and dropped when that holds for every column.
+    """
+    dates = pd.DatetimeIndex(daily_df['Date'])
+    quarter_codes = dates.year.values * 4 + dates.quarter.values - 1
+    quarters = np.unique(quarter_codes)
+    returns = np.full((len(quarters), len(price_cols)), np.nan)
+    has_return = np.zeros((len(quarters), len(price_cols)), dtype=bool)
+    start_rows = np.full(len(quarters), len(dates))
+    end_rows = np.full(len(quarters), -1)
+    for j, price_col in enumerate(price_cols):
+        values = daily_df[price_col].to_numpy(dtype=float)
+        # Remove empty data
+        rows = np.flatnonzero(values != 0)
+        row_quarters = np.searchsorted(quarters, quarter_codes[rows])
+        counts = np.bincount(row_quarters, minlength=len(quarters))
+        first_rows = np.zeros(len(quarters), dtype=np.int64)
+        last_rows = np.zeros(len(quarters), dtype=np.int64)
+        present, first_idx = np.unique(row_quarters, return_index=True)
+        first_rows[present] = rows[first_idx]
+        present, last_idx = np.unique(row_quarters[::-1], return_index=True)
+        last_rows[present] = rows[::-1][last_idx]
+
+        valid = counts > 2
+        quarter_start_close = values[first_rows[valid]]
+        quarter_end_close = values[last_rows[valid]]
+        returns[valid, j] = (quarter_end_close - quarter_start_close) / quarter_start_close * 100
+        has_return[:, j] = valid
+        start_rows[valid] = np.minimum(start_rows[valid], first_rows[valid])
+        end_rows[valid] = np.maximum(end_rows[valid], last_rows[valid])
+
+    keep = has_return.any(axis=1)
+    quarterly_dict = {'start_period': [date.date() for date in dates[start_rows[keep]]],
+                      'end_period': [date.date() for date in dates[end_rows[keep]]]}
+    for j, price_col in enumerate(price_cols):
+        quarterly_dict[price_col] = returns[keep, j]
+    return pd.DataFrame(quarterly_dict)
+
 def cal_fitness_with_quarterly_returns(daily_df, fitness, price_col='Close'):
-    quarterly_dict = {'start_period': [], 'end_period': [], 'quarterly_return': []}
-    start_year = daily_df['Date'].iloc[0].year
-    end_year = daily_df['Date'].iloc[-1].year
-    for year in range(start_year, end_year + 1):
-        for quarter_start in range(1,13,3):
-            q_start = '{}-{}-1'.format(year, quarter_start)
-            q_end = '{}-{}-{}'.format(year, quarter_start + 2, calendar.monthrange(year, quarter_start + 2)[1])
-            temp_df = daily_df[(daily_df['Date'] >= q_start) & (daily_df['Date'] <= q_end)]
-            # Remove empty data
-            temp_df = temp_df[temp_df[price_col] != 0]
-            if len(temp_df.index) > 2:
-                quarter_start_close = temp_df[price_col].iloc[0]
-                quarter_end_close = temp_df[price_col].iloc[-1]
-                quarter_return = (quarter_end_close - quarter_start_close) / quarter_start_close * 100
-                quarterly_dict['start_period'].append(temp_df['Date'].iloc[0].date())
-                quarterly_dict['end_period'].append(temp_df['Date'].iloc[-1].date())
-                quarterly_dict['quarterly_return'].append(quarter_return)
-    quarterly_df = pd.DataFrame(quarterly_dict)
+    quarterly_df = cal_quarterly_returns(daily_df, [price_col])
+    quarterly_df = quarterly_df.rename(columns={price_col: 'quarterly_return'})
     fitness_value = sum(quarterly_df['quarterly_return'].values)
     if math.isnan(fitness_value):
         fitness_value = 0
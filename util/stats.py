@@ -42,6 +42,19 @@ def z_score_normalization(x, x_arr: list):
 	std_x = np.std(temp_list)
 	return (x - mean_x)/std_x
 
+def window_z_score(x: np.ndarray, windows: np.ndarray) -> np.ndarray:
+    """z_score_normalization(x[i], windows[i]) of every row of a 2D array, ignoring nan entries
+    """
+    counts = np.count_nonzero(~np.isnan(windows), axis=1)
+    z = np.zeros(len(windows))
+    full = counts == windows.shape[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z[full] = (x[full] - windows[full].mean(axis=1)) / windows[full].std(axis=1)
+    # Short windows at the start of the series and windows with gaps
+    for row in np.flatnonzero((counts > 0) & ~full):
+        z[row] = z_score_normalization(x[row], windows[row])
+    return z
+
 def z_score_normalization_list(x_arr: list):
 	mean_x = np.mean(x_arr)
 	std_x = np.std(x_arr)
@@ -59,4 +72,31 @@ def scale_to_1(x, x_arr: list):
 def scale(x, x_arr: list):
 	x_max = max(x_arr)
 	x_min = min(x_arr)
-	return x / (x_max - x_min)
\ No newline at end of file
+	return x / (x_max - x_min)
+
+def window_var_cvar(windows: np.ndarray, alpha=0.95) -> tuple:
+    """Percent VaR and CVaR of every row of a 2D array of returns, ignoring nan entries
+
+    Each row gives np.percentile(row, 100*(1-alpha)) and the nanmean of the returns below it, as for a single
+    list of returns. Rows without returns get 0 for both. Returns (var array, cvar array).
+    """
+    counts = np.count_nonzero(~np.isnan(windows), axis=1)
+    # nan sorts last, so the first counts[i] entries of a sorted row are its returns
+    sorted_windows = np.sort(windows, axis=1)
+    var = np.zeros(len(windows))
+    for count in np.unique(counts[counts > 0]):
+        rows = np.flatnonzero(counts == count)
+        var[rows] = np.percentile(sorted_windows[rows, :count], 100*(1-alpha), axis=1)
+
+    with np.errstate(invalid='ignore'):
+        below = windows < var[:, np.newaxis]
+    below_counts = np.count_nonzero(below, axis=1)
+    # Summed in row order, the same order as the nanmean of the filtered list
+    below_sums = np.cumsum(np.where(below, windows, 0), axis=1)[:, -1] if windows.shape[1] else np.zeros(len(windows))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cvar = np.where(below_counts > 0, below_sums / below_counts, np.nan)
+    # numpy sums 8 or more values pairwise, which a running sum does not reproduce
+    for row in np.flatnonzero(below_counts >= 8):
+        cvar[row] = np.mean(windows[row][below[row]])
+    cvar[counts == 0] = 0
+    return var, cvar